@@ -21,16 +21,24 @@
 
 import gi
 gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
 gi.require_version('Gedit', '3.0')
 gi.require_version('Gio', '2.0')
 
-from gi.repository import GObject, Gedit, Gio
+from gi.repository import GObject, GLib, Gedit, Gio
 from .closingmixin import ExMortisAppActivatableClosingMixin
 from .existingmixin import ExMortisAppActivatableExistingMixin
+from .handlers import connect_handlers, disconnect_handlers
+from .instrument import instrument_methods
+from .metrics import dump_snapshot, start_timing_calls, stop_timing_calls
 from .plugin import _
+from .profiler import ExMortisProfiler, is_profiling_requested
 from .quittingmixin import ExMortisAppActivatableQuittingMixin
-from .settings import ExMortisSettings
-from .utils import connect_handlers, disconnect_handlers
+from .sessioncheck import check_session
+from .settings import ExMortisSettings, release_settings_cache
+from .tracerecorder import ExMortisTraceRecorder, is_tracing_requested
+from .utils import create_bindings, release_bindings
+from .watchdog import ExMortisWatchdog
 from .windowmanager import ExMortisWindowManager
 from . import log
 
@@ -57,6 +65,20 @@ class ExMortisAppActivatable(
 		is_primary = not (app.get_flags() & Gio.ApplicationFlags.NON_UNIQUE)
 		window_manager = ExMortisWindowManager(app)
 		settings = ExMortisSettings(is_primary)
+		profiler = ExMortisProfiler()
+		watchdog = ExMortisWatchdog()
+
+		trace_recorder = ExMortisTraceRecorder()
+
+		if is_profiling_requested(settings):
+			profiler.start()
+
+		if is_tracing_requested(settings):
+			trace_recorder.start()
+
+		# timing every call is only worth its overhead while debugging
+		if is_timing_requested(settings):
+			start_timing_calls()
 
 		# app
 		connect_handlers(
@@ -83,10 +105,25 @@ class ExMortisAppActivatable(
 		# settings
 		connect_handlers(
 			self, settings,
-			['notify::restore-between-sessions'],
+			[
+				'notify::restore-between-sessions',
+				'notify::persistence-mode',
+				'notify::profile',
+				'notify::trace'
+			],
 			'settings',
 			window_manager
 		)
+		create_bindings(
+			self, settings, window_manager,
+			{'prewarm-window': 'prewarm-window'},
+			GObject.BindingFlags.SYNC_CREATE
+		)
+		create_bindings(
+			self, settings, watchdog,
+			{'watchdog-budget': 'budget'},
+			GObject.BindingFlags.SYNC_CREATE
+		)
 
 		# reopen action
 		reopen_action = Gio.SimpleAction.new('reopen-closed-window', None)
@@ -111,6 +148,15 @@ class ExMortisAppActivatable(
 		)
 		menu_ext.append_menu_item(menu_item)
 
+		# dump metrics action
+		dump_metrics_action = Gio.SimpleAction.new('ex-mortis-dump-metrics', None)
+		connect_handlers(
+			self, dump_metrics_action,
+			['activate'],
+			'dump_metrics'
+		)
+		app.add_action(dump_metrics_action)
+
 		# quit action
 		original_quit_action = app.lookup_action('quit')
 		custom_quit_action = Gio.SimpleAction.new('quit', None)
@@ -125,14 +171,20 @@ class ExMortisAppActivatable(
 
 		self._window_manager = window_manager
 		self._settings = settings
+		self._profiler = profiler
+		self._watchdog = watchdog
+		self._trace_recorder = trace_recorder
 		self._reopen_action = reopen_action
+		self._dump_metrics_action = dump_metrics_action
 		self._menu_ext = menu_ext
 		self._original_quit_action = original_quit_action
 		self._custom_quit_action = custom_quit_action
 
 		self.do_activate_existing()
-		self.do_activate_closing()
-		self.do_activate_quitting(settings.restore_between_sessions)
+		self.do_activate_closing(settings, is_primary)
+		self.do_activate_quitting(settings, is_primary)
+
+		self.update_reopen_action_enabled()
 
 		# windows
 		windows = app.get_main_windows()
@@ -147,6 +199,15 @@ class ExMortisAppActivatable(
 			for window in windows:
 				self.setup_window(window, is_existing=True)
 
+		# after windows are restored
+		if is_primary and settings.can_save:
+			self._check_session_id = GLib.idle_add(
+				self.on_check_session_idle,
+				priority=GLib.PRIORITY_LOW
+			)
+		else:
+			self._check_session_id = None
+
 	def do_deactivate(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
@@ -159,11 +220,20 @@ class ExMortisAppActivatable(
 		for window in app.get_main_windows():
 			self.teardown_window(window)
 
+		# session check
+		if self._check_session_id:
+			GLib.source_remove(self._check_session_id)
+			self._check_session_id = None
+
 		# quit action
 		app.remove_action('quit')
 		app.add_action(self._original_quit_action)
 		disconnect_handlers(self, self._custom_quit_action)
 
+		# dump metrics action
+		app.remove_action('ex-mortis-dump-metrics')
+		disconnect_handlers(self, self._dump_metrics_action)
+
 		# reopen menu item
 		app.set_accels_for_action('app.reopen-closed-window', [])
 
@@ -171,6 +241,8 @@ class ExMortisAppActivatable(
 		app.remove_action('reopen-closed-window')
 
 		# settings
+		release_bindings(self, settings, window_manager)
+		release_bindings(self, settings, self._watchdog)
 		disconnect_handlers(self, settings)
 
 		# window manager
@@ -181,17 +253,27 @@ class ExMortisAppActivatable(
 
 		window_manager.cleanup()
 		settings.cleanup()
+		release_settings_cache()
+		self._profiler.cleanup()
+		self._watchdog.cleanup()
+		self._trace_recorder.cleanup()
+
+		stop_timing_calls()
 
 		self._window_manager = None
 		self._settings = None
+		self._profiler = None
+		self._watchdog = None
+		self._trace_recorder = None
 		self._reopen_action = None
+		self._dump_metrics_action = None
 		self._menu_ext = None
 		self._original_quit_action = None
 		self._custom_quit_action = None
 
 		self.do_deactivate_existing()
-		self.do_deactivate_closing()
-		self.do_deactivate_quitting()
+		self.do_deactivate_closing(settings)
+		self.do_deactivate_quitting(settings)
 
 
 	# window setup
@@ -302,7 +384,7 @@ class ExMortisAppActivatable(
 		if not self.is_existing(window):
 			self.cancel_closing(window)
 
-		self.cancel_quitting()
+		self.cancel_quitting(window_manager, self._settings)
 
 	def on_window_manager_tabs_reordered(self, window_manager, window):
 		if log.query(log.DEBUG):
@@ -311,7 +393,7 @@ class ExMortisAppActivatable(
 		if not self.is_existing(window):
 			self.cancel_closing(window)
 
-		self.cancel_quitting()
+		self.cancel_quitting(window_manager, self._settings)
 
 	def on_app_window_added(self, app, window):
 		if log.query(log.DEBUG):
@@ -323,13 +405,21 @@ class ExMortisAppActivatable(
 
 			return
 
+		if self._window_manager.is_spare_window(window):
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Spare window %s", window))
+
+			return
+
 		if log.query(log.INFO):
 			Gedit.debug_plugin_message(log.format("Adding main window %s", window))
 
-		self.cancel_quitting()
+		self.cancel_quitting(self._window_manager, self._settings)
 
 		self.setup_window(window)
 
+		self._window_manager.schedule_spare_window()
+
 
 	# end closing / quitting
 
@@ -343,11 +433,20 @@ class ExMortisAppActivatable(
 
 			return
 
+		if self._window_manager.is_spare_window(window):
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Spare window %s", window))
+
+			return
+
 		if log.query(log.INFO):
 			Gedit.debug_plugin_message(log.format("Removing main window %s", window))
 
 		if not self.is_existing(window):
-			self.end_closing(window)
+			self.end_closing(
+				window,
+				self.is_quitting() and self._settings.restore_between_sessions
+			)
 			self.update_reopen_action_enabled()
 
 		self.teardown_window(window)
@@ -358,7 +457,12 @@ class ExMortisAppActivatable(
 
 		settings = self._settings
 
-		self.end_quitting(settings, settings.restore_between_sessions)
+		self.end_quitting(self._window_manager, settings, settings.restore_between_sessions)
+		self.flush_window_states()
+
+		# the plugin may not be deactivated before gedit exits
+		self._profiler.dump()
+		self._trace_recorder.flush()
 
 
 	# toggled restore between sessions setting
@@ -384,6 +488,77 @@ class ExMortisAppActivatable(
 			self.stop_saving_window_states(window_manager, settings)
 
 
+	# changed persistence mode setting
+
+	def on_settings_notify_persistence_mode(self, settings, pspec, window_manager):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("persistence-mode=%s", settings.persistence_mode))
+
+		if not self.is_saving_window_states():
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Not saving window states"))
+
+			return
+
+		# rebind windows in the new mode
+		self.stop_saving_window_states(window_manager, settings)
+		self.start_saving_window_states(window_manager, settings)
+
+
+	# toggled profile setting
+
+	def on_settings_notify_profile(self, settings, pspec, window_manager):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("profile=%s", settings.profile))
+
+		if is_profiling_requested(settings):
+			self._profiler.start()
+		else:
+			self._profiler.stop()
+
+		self.update_timing_calls(settings)
+
+
+	# dump metrics
+
+	def on_dump_metrics_activate(self, action, parameter):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		try:
+			dump_snapshot()
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not write metrics: %s", e))
+
+
+	# session check
+
+	def on_check_session_idle(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._check_session_id = None
+
+		check_session(do_repair=True, live_settings=self._settings)
+
+		return False
+
+
+	# toggled trace setting
+
+	def on_settings_notify_trace(self, settings, pspec, window_manager):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("trace=%s", settings.trace))
+
+		if is_tracing_requested(settings):
+			self._trace_recorder.start()
+		else:
+			self._trace_recorder.stop()
+
+		self.update_timing_calls(settings)
+
+
 	# reopen closed window
 
 	def on_reopen_activate(self, action, parameter, window_manager):
@@ -426,9 +601,25 @@ class ExMortisAppActivatable(
 
 		self._reopen_action.set_enabled(can_reopen)
 
+	def update_timing_calls(self, settings):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if is_timing_requested(settings):
+			start_timing_calls()
+		else:
+			stop_timing_calls()
+
 	def really_quit(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
 		self._original_quit_action.activate()
 
+
+def is_timing_requested(settings):
+	return is_profiling_requested(settings) or is_tracing_requested(settings)
+
+
+# signal handlers and timeout / idle callbacks
+instrument_methods(ExMortisAppActivatable, ('on_',))
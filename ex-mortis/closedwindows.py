@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# closedwindows.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('Gedit', '3.0')
+
+import json
+import os
+import os.path
+import struct
+from gi.repository import GObject, Gedit
+from .windowstate import ExMortisWindowState
+from . import log
+
+
+# closed windows are stored in two files:
+# the log, which holds one json record per closed window, only ever appended to
+# (except when compacted), and the index, which holds the offset and length of
+# each live record in the log, in stack order
+#
+# reopening a window truncates the last index entry and leaves a dead record in
+# the log, which is reclaimed when the log is compacted
+#
+# on startup only the index is read; records are read when they are reopened
+
+LOG_FILENAME = 'closed-windows.log'
+
+INDEX_FILENAME = 'closed-windows.idx'
+
+INDEX_ENTRY = struct.Struct('<QI')
+
+# maximum number of closed windows to keep
+MAX_ENTRIES = 32
+
+# maximum total size of the live records
+MAX_SIZE = 1024 * 1024
+
+# do not bother compacting if there are fewer dead bytes than this
+MIN_COMPACT_SIZE = 64 * 1024
+
+
+class ExMortisClosedWindows(GObject.Object):
+
+	__gtype_name__ = 'ExMortisClosedWindows'
+
+
+	def __init__(self, directory=None):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("directory=%s", directory))
+
+		self._directory = directory
+		self._is_persisting = bool(directory)
+		# (offset, length) for records in the log, ExMortisWindowState for
+		# windows that could not be written; records always come first
+		self._entries = None
+		self._log_size = 0
+
+	def __len__(self):
+		self.load_index()
+
+		return len(self._entries)
+
+
+	# stack
+
+	def push(self, state):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.load_index()
+
+		entry = state
+
+		if self._is_persisting:
+			record = encode_record(state)
+
+			try:
+				offset = self.append_record(record)
+
+			except OSError as e:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Could not write closed window, will not persist for this session: %s", e))
+
+				self._is_persisting = False
+
+			else:
+				entry = (offset, len(record))
+
+		self._entries.append(entry)
+
+		self.enforce_limits()
+
+	def pop(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.load_index()
+
+		if not self._entries:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("No closed windows"))
+
+			return None
+
+		entry = self._entries.pop()
+
+		if isinstance(entry, ExMortisWindowState):
+			return entry
+
+		offset, length = entry
+		state = None
+
+		try:
+			state = decode_record(self.read_record(offset, length))
+		except (OSError, TypeError, ValueError) as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not read closed window: %s", e))
+
+		try:
+			self.write_index_length()
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not update closed windows index: %s", e))
+
+		self.maybe_compact()
+
+		return state
+
+
+	# limits / compaction
+
+	def enforce_limits(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		entries = self._entries
+		num_dropped = 0
+
+		while len(entries) > 1 and (len(entries) > MAX_ENTRIES or self.get_live_size() > MAX_SIZE):
+			entries.pop(0)
+			num_dropped += 1
+
+		if num_dropped:
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Dropped %s oldest closed windows", num_dropped))
+
+			self.compact()
+
+		else:
+			self.maybe_compact()
+
+	def maybe_compact(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self._is_persisting:
+			return
+
+		live_size = self.get_live_size()
+		dead_size = self._log_size - live_size
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("live_size=%s, dead_size=%s", live_size, dead_size))
+
+		if dead_size >= MIN_COMPACT_SIZE and dead_size > live_size:
+			self.compact()
+
+	def compact(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self._is_persisting:
+			return
+
+		log_path, index_path = self.get_paths()
+		records = []
+
+		try:
+			for entry in self._entries:
+				if isinstance(entry, ExMortisWindowState):
+					records.append(encode_record(entry))
+				else:
+					records.append(self.read_record(*entry))
+
+			entries = []
+			offset = 0
+
+			with open(log_path + '.tmp', 'wb') as f:
+				for record in records:
+					f.write(record)
+					entries.append((offset, len(record)))
+					offset += len(record)
+
+			with open(index_path + '.tmp', 'wb') as f:
+				for entry in entries:
+					f.write(INDEX_ENTRY.pack(*entry))
+
+			os.replace(log_path + '.tmp', log_path)
+			os.replace(index_path + '.tmp', index_path)
+
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not compact closed windows: %s", e))
+
+			return
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Compacted closed windows log from %s to %s bytes", self._log_size, offset))
+
+		self._entries = entries
+		self._log_size = offset
+
+	def get_live_size(self):
+		return sum(
+			entry[1]
+			for entry in self._entries
+			if not isinstance(entry, ExMortisWindowState)
+		)
+
+
+	# files
+
+	def get_paths(self):
+		return (
+			os.path.join(self._directory, LOG_FILENAME),
+			os.path.join(self._directory, INDEX_FILENAME)
+		)
+
+	def load_index(self):
+		if self._entries is not None:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._entries = []
+
+		if not self._is_persisting:
+			return
+
+		log_path, index_path = self.get_paths()
+
+		try:
+			log_size = os.path.getsize(log_path)
+
+			with open(index_path, 'rb') as f:
+				data = f.read()
+
+		except OSError:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("No closed windows files"))
+
+			return
+
+		entries = []
+
+		for offset, length in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+			if offset + length > log_size:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Closed windows index entry beyond end of log, ignoring remaining entries"))
+
+				break
+
+			entries.append((offset, length))
+
+		self._entries = entries
+		self._log_size = log_size
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Loaded %s closed windows", len(entries)))
+
+		if len(entries) * INDEX_ENTRY.size != len(data):
+			try:
+				self.write_index_length()
+			except OSError as e:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Could not update closed windows index: %s", e))
+
+	def append_record(self, record):
+		log_path, index_path = self.get_paths()
+
+		os.makedirs(self._directory, exist_ok=True)
+
+		with open(log_path, 'ab') as f:
+			offset = f.tell()
+			f.write(record)
+
+		with open(index_path, 'ab') as f:
+			f.write(INDEX_ENTRY.pack(offset, len(record)))
+
+		self._log_size = offset + len(record)
+
+		return offset
+
+	def read_record(self, offset, length):
+		log_path, index_path = self.get_paths()
+
+		with open(log_path, 'rb') as f:
+			f.seek(offset)
+			record = f.read(length)
+
+		if len(record) != length:
+			raise ValueError("Short read from closed windows log")
+
+		return record
+
+	def write_index_length(self):
+		if not self._is_persisting:
+			return
+
+		log_path, index_path = self.get_paths()
+		num_records = sum(
+			1
+			for entry in self._entries
+			if not isinstance(entry, ExMortisWindowState)
+		)
+
+		os.truncate(index_path, num_records * INDEX_ENTRY.size)
+
+
+def encode_record(state):
+	return json.dumps(state.to_dict(), separators=(',', ':')).encode('utf-8') + b'\n'
+
+def decode_record(record):
+	return ExMortisWindowState.from_dict(json.loads(record.decode('utf-8')))
@@ -20,27 +20,50 @@
 # with this program; if not, see <https://www.gnu.org/licenses/>.
 
 import gi
+gi.require_version('GObject', '2.0')
 gi.require_version('Gedit', '3.0')
 
-from gi.repository import Gedit
+from gi.repository import GObject, Gedit
+from .closedwindows import ExMortisClosedWindows
+from .plugin import user_data_dir
+from .retaineddocuments import ExMortisRetainedDocuments
+from .utils import create_bindings, release_bindings
+from .weakobjectmap import WeakObjectMap
 from . import log
 
 
 class ExMortisAppActivatableClosingMixin(object):
 
-	def do_activate_closing(self):
+	def do_activate_closing(self, settings, is_persisting_closed):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format(""))
+			Gedit.debug_plugin_message(log.format("is_persisting_closed=%s", is_persisting_closed))
+
+		retained = ExMortisRetainedDocuments()
 
-		self._closing = {}
-		self._closed = []
+		create_bindings(
+			self, settings, retained,
+			{
+				'retain-closed-documents-time': 'timeout',
+				'retain-closed-documents-size': 'max-size'
+			},
+			GObject.BindingFlags.SYNC_CREATE
+		)
 
-	def do_deactivate_closing(self):
+		self._closing = WeakObjectMap()
+		self._closed = ExMortisClosedWindows(user_data_dir if is_persisting_closed else None)
+		self._retained = retained
+
+	def do_deactivate_closing(self, settings):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
+		release_bindings(self, settings, self._retained)
+
+		self._retained.cleanup()
+
 		self._closing = None
 		self._closed = None
+		self._retained = None
 
 
 	# closing
@@ -93,9 +116,15 @@ class ExMortisAppActivatableClosingMixin(object):
 		state.save_uri(window, tab)
 		state.forget_tab(tab)
 
-	def end_closing(self, window):
+		# documents closed while quitting would be thrown away when gedit exits
+		if not self.is_quitting():
+			self._retained.retain(tab)
+
+	# windows closed while quitting are not cached if they will be saved with
+	# the session, otherwise they could be reopened after they are restored
+	def end_closing(self, window, is_saving_session=False):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
+			Gedit.debug_plugin_message(log.format("%s, is_saving_session=%s", window, is_saving_session))
 
 		if not self.is_closing(window):
 			if log.query(log.WARNING):
@@ -105,11 +134,18 @@ class ExMortisAppActivatableClosingMixin(object):
 
 		state = self._closing[window]
 
-		if state.restore_uris:
+		if is_saving_session:
+			if log.query(log.MESSAGE):
+				Gedit.debug_plugin_message(log.format("Saving session, not caching window info"))
+
+		elif state.restore_uris:
 			if log.query(log.MESSAGE):
 				Gedit.debug_plugin_message(log.format("Caching window info"))
 
-			self._closed.append(state)
+			# all tabs have been closed, don't hold on to them
+			state.forget_tabs()
+
+			self._closed.push(state)
 
 		else:
 			if log.query(log.MESSAGE):
@@ -133,5 +169,13 @@ class ExMortisAppActivatableClosingMixin(object):
 
 			return
 
-		window_manager.open_new_window_with_window_state(self._closed.pop())
+		while self.can_reopen():
+			state = self._closed.pop()
+
+			if state:
+				window_manager.open_new_window_with_window_state(state, self._retained)
+				break
+
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not load closed window, trying next"))
 
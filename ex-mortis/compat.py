@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# compat.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('Gedit', '3.0')
+
+from gi.repository import GObject, Gedit
+
+
+# the gedit api differs between versions; each difference is probed once, here,
+# instead of trying one api and catching AttributeError on every call
+
+HAS_DOCUMENT_GET_FILE = hasattr(Gedit.Document, 'get_file') # added in gedit 3.14
+
+HAS_DOCUMENT_IS_UNTOUCHED = hasattr(Gedit.Document, 'is_untouched') # removed in gedit 44
+
+HAS_LIST_PROPERTIES = hasattr(GObject.Object, 'list_properties') # added in gedit 3.14
+
+HAS_WINDOW_TABS_REORDERED = GObject.signal_lookup('tabs-reordered', Gedit.Window) > 0 # removed in gedit 47
+
+if hasattr(Gedit.TabState, 'NORMAL'):
+	TAB_STATE_NORMAL = Gedit.TabState.NORMAL
+else:
+	TAB_STATE_NORMAL = Gedit.TabState.STATE_NORMAL # before gedit 47
+
+
+if HAS_DOCUMENT_GET_FILE:
+	def get_document_location(document):
+		return document.get_file().get_location()
+else:
+	def get_document_location(document):
+		return document.get_location()
+
+def get_tab_uri(tab):
+	location = get_document_location(tab.get_document())
+	return location.get_uri() if location else ''
+
+# takes a GObject class or instance
+if HAS_LIST_PROPERTIES:
+	def list_properties(obj):
+		return obj.list_properties()
+else:
+	list_properties = GObject.list_properties
+
+if HAS_DOCUMENT_IS_UNTOUCHED:
+	def document_is_untouched(document):
+		return document.is_untouched()
+else:
+	# based on tepl_buffer_is_untouched() in tepl-buffer.c
+	def document_is_untouched(document):
+		return (
+			document.get_char_count() == 0
+			and not document.get_modified()
+			and not document.can_undo()
+			and not document.can_redo()
+			and get_document_location(document) is None
+		)
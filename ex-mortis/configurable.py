@@ -26,10 +26,12 @@ gi.require_version('Gio', '2.0')
 gi.require_version('Gtk', '3.0')
 gi.require_version('PeasGtk', '1.0')
 
+import json
 from gi.repository import GObject, Gedit, Gio, Gtk, PeasGtk
 from .plugin import _
 from .settings import ExMortisSettings
-from .utils import create_bindings
+from .utils import create_bindings, release_bindings
+from . import metrics
 from . import log
 
 
@@ -61,7 +63,7 @@ class ExMortisConfigurable(GObject.Object, PeasGtk.Configurable):
 			)
 
 			widget.set_active(settings.restore_between_sessions)
-			widget._settings = settings
+			widget.connect('destroy', self.on_restore_widget_destroy, settings)
 
 		else:
 			widget = Gtk.Label.new(_("Could not load settings schema"))
@@ -72,6 +74,68 @@ class ExMortisConfigurable(GObject.Object, PeasGtk.Configurable):
 		box.set_margin_top(12)
 		box.set_margin_bottom(12)
 		box.add(widget)
+		box.add(self.create_debug_widget())
 
 		return box
 
+	def create_debug_widget(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		text_view = Gtk.TextView.new()
+		text_view.set_editable(False)
+		text_view.set_monospace(True)
+
+		scrolled_window = Gtk.ScrolledWindow.new(None, None)
+		scrolled_window.set_size_request(-1, 200)
+		scrolled_window.add(text_view)
+
+		refresh_button = Gtk.Button.new_with_label(_("Refresh"))
+		refresh_button.connect('clicked', self.on_debug_refresh_clicked, text_view)
+
+		save_button = Gtk.Button.new_with_label(_("Save to File"))
+		save_button.connect('clicked', self.on_debug_save_clicked)
+
+		button_box = Gtk.ButtonBox.new(Gtk.Orientation.HORIZONTAL)
+		button_box.set_layout(Gtk.ButtonBoxStyle.END)
+		button_box.set_spacing(6)
+		button_box.add(refresh_button)
+		button_box.add(save_button)
+
+		debug_box = Gtk.Box.new(Gtk.Orientation.VERTICAL, 6)
+		debug_box.set_margin_top(6)
+		debug_box.add(scrolled_window)
+		debug_box.add(button_box)
+
+		expander = Gtk.Expander.new(_("Debug"))
+		expander.set_margin_top(12)
+		expander.add(debug_box)
+
+		self.update_debug_text(text_view)
+
+		return expander
+
+	def update_debug_text(self, text_view):
+		text = json.dumps(metrics.get_snapshot(), indent=1, sort_keys=True)
+		text_view.get_buffer().set_text(text)
+
+	def on_restore_widget_destroy(self, widget, settings):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		release_bindings(self, settings, widget)
+
+		settings.cleanup()
+
+	def on_debug_refresh_clicked(self, button, text_view):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.update_debug_text(text_view)
+
+	def on_debug_save_clicked(self, button):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		Gedit.App.get_default().activate_action('ex-mortis-dump-metrics', None)
+
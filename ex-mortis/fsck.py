@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# fsck.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+# checks (and with --repair, prunes) the saved session of the current user,
+# without gedit; see sessioncheck.py for what is checked:
+#
+#     python3 fsck.py [--repair] [--verbose]
+#
+# gedit should not be running while repairing, as it may be writing the same
+# settings
+#
+# plugin modules are loaded with the fake gedit modules of replay.py
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os.path
+import sys
+import tempfile
+
+
+def load_replay():
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay.py')
+	spec = importlib.util.spec_from_file_location('exmortisreplaytool', path)
+	replay = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(replay)
+
+	return replay
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Check the Ex-Mortis saved session")
+	parser.add_argument('--repair', action='store_true', help="prune orphaned, duplicated and corrupt entries")
+	parser.add_argument('--verbose', action='store_true', help="print plugin log messages")
+	args = parser.parse_args(argv)
+
+	replay = load_replay()
+	replay.install_fake_modules(replay.create_fake_modules((0, 0), args.verbose))
+
+	with tempfile.TemporaryDirectory() as cache_dir:
+		package = replay.load_package(cache_dir)
+		sessioncheck = importlib.import_module(package.__name__ + '.sessioncheck')
+
+		report = sessioncheck.check_session(do_repair=args.repair)
+
+	if report is None:
+		print("Could not load settings", file=sys.stderr)
+		return 2
+
+	json.dump(report, sys.stdout, indent=1, sort_keys=True)
+	print()
+
+	is_clean = not any(value for name, value in report.items() if name != 'reclaimed-bytes')
+
+	return 0 if is_clean or args.repair else 1
+
+
+if __name__ == '__main__':
+	# do not let plugin modules shadow standard modules when run as a script
+	script_directory = os.path.dirname(os.path.abspath(__file__))
+	sys.path = [path for path in sys.path if os.path.abspath(path or '.') != script_directory]
+
+	sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# handlers.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+
+import weakref
+from gi.repository import GObject
+from .utils import to_name
+
+
+# a signal handler registry with the same interface as the handler functions
+# in utils (python-gtk-utils)
+#
+# handler ids for every (namespace, target) pair are kept here instead of on
+# the target, so that targets can be disconnected in bulk and finished targets
+# do not keep handler ids around
+#
+# namespaces are keyed by instance, so that two instances of the same class
+# do not share handler ids for the same target
+#
+# targets and namespaces are only held by weak reference; a target that is
+# destroyed (for widgets) or finalized, or a namespace that is finalized, is
+# dropped from the registry automatically
+
+# (ns address, target address) -> entry
+_handlers = {}
+
+# (ns address, group address) -> set of keys in _handlers
+_handler_groups = {}
+
+# ns address -> finalizer
+_namespaces = {}
+
+_handler_stats = {
+	'connected': 0,
+	'disconnected': 0,
+	'destroyed': 0,
+	'finalized': 0
+}
+
+
+class _HandlerEntry(object):
+
+	def __init__(self, ns_key, target, group_key):
+		self.key = (ns_key, hash(target))
+		self.ids = []
+		self.group_key = group_key
+		self.destroy_id = None
+		self.ref = target.weak_ref(_on_handler_target_finalized, self.key)
+
+		if GObject.signal_lookup('destroy', target.__gtype__):
+			self.destroy_id = target.connect('destroy', _on_handler_target_destroy, self.key)
+
+
+def _get_ns_key(ns):
+	return id(ns)
+
+def _watch_ns(ns):
+	ns_key = _get_ns_key(ns)
+
+	if ns_key not in _namespaces:
+		_namespaces[ns_key] = weakref.finalize(ns, _on_ns_finalized, ns_key)
+
+	return ns_key
+
+def _get_handler_entry(ns, target):
+	return _handlers.get((_get_ns_key(ns), hash(target)))
+
+def _get_handler_ids(ns, target):
+	entry = _get_handler_entry(ns, target)
+	return entry.ids if entry else []
+
+def _add_handler_entry(ns, target, group):
+	ns_key = _watch_ns(ns)
+	group_key = (ns_key, hash(group)) if group is not None else None
+	entry = _HandlerEntry(ns_key, target, group_key)
+
+	_handlers[entry.key] = entry
+
+	if group_key:
+		_handler_groups.setdefault(group_key, set()).add(entry.key)
+
+	return entry
+
+def _remove_handler_entry(key, disconnect, stat):
+	entry = _handlers.pop(key, None)
+	if not entry:
+		return
+
+	if entry.group_key in _handler_groups:
+		keys = _handler_groups[entry.group_key]
+		keys.discard(key)
+		if not keys:
+			del _handler_groups[entry.group_key]
+
+	target = entry.ref()
+	if target is not None:
+		if disconnect:
+			for handler_id in entry.ids:
+				target.disconnect(handler_id)
+			if entry.destroy_id is not None:
+				target.disconnect(entry.destroy_id)
+		entry.ref.unref()
+
+	_handler_stats[stat] += len(entry.ids)
+
+def _on_handler_target_destroy(target, key):
+	# dispose will disconnect the handlers
+	_remove_handler_entry(key, False, 'destroyed')
+
+def _on_handler_target_finalized(key):
+	_remove_handler_entry(key, False, 'finalized')
+
+def _on_ns_finalized(ns_key):
+	del _namespaces[ns_key]
+
+	# the address may be reused by a new namespace
+	for key in [key for key in _handlers if key[0] == ns_key]:
+		_remove_handler_entry(key, True, 'finalized')
+
+def connect_handlers(ns, target, signals, prefix_or_fn, *args, **kwargs):
+	group = kwargs.get('group')
+	entry = _get_handler_entry(ns, target)
+
+	if not entry:
+		entry = _add_handler_entry(ns, target, group)
+
+	for signal in signals:
+		if hasattr(prefix_or_fn, '__call__'):
+			fn = prefix_or_fn
+		else:
+			fn = getattr(ns, 'on_%s_%s' % (prefix_or_fn, to_name(signal)))
+
+		entry.ids.append(target.connect(signal, fn, *args))
+
+	_handler_stats['connected'] += len(signals)
+
+def disconnect_handlers(ns, target):
+	_remove_handler_entry((_get_ns_key(ns), hash(target)), True, 'disconnected')
+
+def disconnect_handler_group(ns, group):
+	group_key = (_get_ns_key(ns), hash(group))
+
+	for key in list(_handler_groups.get(group_key, [])):
+		_remove_handler_entry(key, True, 'disconnected')
+
+def block_handlers(ns, target):
+	for handler_id in _get_handler_ids(ns, target):
+		target.handler_block(handler_id)
+
+def unblock_handlers(ns, target):
+	for handler_id in _get_handler_ids(ns, target):
+		target.handler_unblock(handler_id)
+
+# connected - disconnected - destroyed - finalized should equal live; if live
+# keeps growing, handlers are not being disconnected
+def handler_stats(ns=None):
+	ns_key = _get_ns_key(ns) if ns is not None else None
+	entries = [
+		entry
+		for key, entry in _handlers.items()
+		if ns_key is None or key[0] == ns_key
+	]
+
+	stats = dict(_handler_stats)
+	stats['targets'] = len(entries)
+	stats['live'] = sum(len(entry.ids) for entry in entries)
+	stats['groups'] = len(_handler_groups)
+
+	return stats
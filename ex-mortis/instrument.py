@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# instrument.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import functools
+import inspect
+
+
+# instrumented functions report to observers when they are called
+#
+# an observer has two methods: begin(name, args, kwargs), which returns a
+# token, and end(name, token), called with that token when the function
+# returns (or raises); observers are called in the reverse order for end()
+#
+# args and kwargs are the arguments of the call (args includes self)
+#
+# calls are always counted; with no observers, the only other overhead is
+# one check per call
+
+_observers = []
+
+# name -> number of calls
+_call_counts = {}
+
+def add_observer(observer):
+	if observer not in _observers:
+		_observers.append(observer)
+
+def remove_observer(observer):
+	if observer in _observers:
+		_observers.remove(observer)
+
+def get_call_counts():
+	return dict(_call_counts)
+
+def reset_call_counts():
+	_call_counts.clear()
+
+def instrumented(fn, name=None):
+	if not name:
+		name = getattr(fn, '__qualname__', fn.__name__)
+
+	@functools.wraps(fn)
+	def wrapper(*args, **kwargs):
+		_call_counts[name] = _call_counts.get(name, 0) + 1
+
+		if not _observers:
+			return fn(*args, **kwargs)
+
+		observers = list(_observers)
+		tokens = [observer.begin(name, args, kwargs) for observer in observers]
+
+		try:
+			return fn(*args, **kwargs)
+		finally:
+			for observer, token in reversed(list(zip(observers, tokens))):
+				observer.end(name, token)
+
+	return wrapper
+
+# instruments the methods of cls whose names start with one of prefixes
+def instrument_methods(cls, prefixes):
+	for attr, value in list(vars(cls).items()):
+		if inspect.isfunction(value) and attr.startswith(prefixes):
+			setattr(cls, attr, instrumented(value, cls.__name__ + '.' + attr))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# metrics.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+
+import json
+import os
+import os.path
+from gi.repository import GObject, GLib, Gedit
+from .plugin import user_cache_dir
+from . import instrument
+from . import log
+
+
+# counters and histograms for the hot paths, kept for the whole session
+#
+# histograms record durations in milliseconds (or any other non-negative
+# value) in power-of-two buckets, so that recording stays cheap
+#
+# the number of times each signal handler / callback ran is counted, under
+# 'call.<name>'; while profiling or tracing, the duration of each call is also
+# recorded in a histogram of the same name
+
+METRICS_DIRNAME = 'metrics'
+
+_counters = {}
+
+# name -> [count, sum, min, max, {bucket upper bound: count}]
+_histograms = {}
+
+_call_timer = None
+
+
+class ExMortisCallTimer(GObject.Object):
+
+	__gtype_name__ = 'ExMortisCallTimer'
+
+
+	def begin(self, name, args, kwargs):
+		return GLib.get_monotonic_time()
+
+	def end(self, name, token):
+		observe('call.' + name, (GLib.get_monotonic_time() - token) / 1000)
+
+
+def increment(name, value=1):
+	_counters[name] = _counters.get(name, 0) + value
+
+def observe(name, value):
+	histogram = _histograms.get(name)
+
+	if histogram is None:
+		histogram = [0, 0, value, value, {}]
+		_histograms[name] = histogram
+
+	histogram[0] += 1
+	histogram[1] += value
+
+	if value < histogram[2]:
+		histogram[2] = value
+	if value > histogram[3]:
+		histogram[3] = value
+
+	bound = 1
+	while bound < value:
+		bound *= 2
+
+	buckets = histogram[4]
+	buckets[bound] = buckets.get(bound, 0) + 1
+
+# returns a start time for observe_elapsed()
+def now():
+	return GLib.get_monotonic_time()
+
+def observe_elapsed(name, start_time):
+	observe(name, (GLib.get_monotonic_time() - start_time) / 1000)
+
+def reset():
+	_counters.clear()
+	_histograms.clear()
+
+	instrument.reset_call_counts()
+
+def get_snapshot():
+	histograms = {}
+
+	for name, (count, total, minimum, maximum, buckets) in _histograms.items():
+		histograms[name] = {
+			'count': count,
+			'sum': total,
+			'min': minimum,
+			'max': maximum,
+			'mean': total / count,
+			'buckets': dict(('<=%s' % bound, num) for bound, num in sorted(buckets.items()))
+		}
+
+	counters = dict(_counters)
+
+	for name, count in instrument.get_call_counts().items():
+		counters['call.' + name] = count
+
+	return {
+		'counters': counters,
+		'histograms': histograms
+	}
+
+def dump_snapshot():
+	filename = 'ex-mortis-%s-%s.json' % (
+		GLib.DateTime.new_now_local().format('%Y%m%d-%H%M%S'),
+		os.getpid()
+	)
+	path = os.path.join(user_cache_dir, METRICS_DIRNAME, filename)
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	with open(path, 'w') as f:
+		json.dump(get_snapshot(), f, indent=1, sort_keys=True)
+
+	if log.query(log.INFO):
+		Gedit.debug_plugin_message(log.format("Wrote metrics to %s", path))
+
+	return path
+
+def start_timing_calls():
+	global _call_timer
+
+	if _call_timer is None:
+		_call_timer = ExMortisCallTimer()
+
+	instrument.add_observer(_call_timer)
+
+def stop_timing_calls():
+	if _call_timer is not None:
+		instrument.remove_observer(_call_timer)
@@ -29,6 +29,10 @@ from gi.repository import GLib, Peas
 
 data_dir = Peas.Engine.get_default().get_plugin_info('ex-mortis').get_data_dir()
 
+user_data_dir = os.path.join(GLib.get_user_data_dir(), 'gedit-ex-mortis')
+
+user_cache_dir = os.path.join(GLib.get_user_cache_dir(), 'gedit-ex-mortis')
+
 try:
 	import locale
 	locale.bindtextdomain('gedit-ex-mortis', os.path.join(data_dir, 'locale'))
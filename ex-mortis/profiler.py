@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# profiler.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+
+import cProfile
+import os
+import os.path
+from gi.repository import GObject, GLib, Gedit
+from .plugin import user_cache_dir
+from . import instrument
+from . import log
+
+
+# profiles instrumented functions (signal handlers, debounced callbacks,
+# restoring and quitting) with cProfile, and writes the results for the
+# session to a .pstats file in the user cache directory
+#
+# enabled with the GEDIT_EX_MORTIS_PROFILE environment variable or the
+# profile setting
+
+ENV_VAR = 'GEDIT_EX_MORTIS_PROFILE'
+
+PROFILES_DIRNAME = 'profiles'
+
+
+class ExMortisProfiler(GObject.Object):
+
+	__gtype_name__ = 'ExMortisProfiler'
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._profile = None
+		self._depth = 0
+		self._path = None
+
+	def cleanup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.stop()
+
+
+	# starting / stopping
+
+	def is_started(self):
+		return self._profile is not None
+
+	def start(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if self.is_started():
+			return
+
+		filename = 'ex-mortis-%s-%s.pstats' % (
+			GLib.DateTime.new_now_local().format('%Y%m%d-%H%M%S'),
+			os.getpid()
+		)
+
+		self._profile = cProfile.Profile()
+		self._depth = 0
+		self._path = os.path.join(user_cache_dir, PROFILES_DIRNAME, filename)
+
+		instrument.add_observer(self)
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Profiling to %s", self._path))
+
+	def stop(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.is_started():
+			return
+
+		instrument.remove_observer(self)
+
+		self.dump()
+
+		self._profile = None
+		self._depth = 0
+		self._path = None
+
+	# can be called more than once; each call rewrites the session file
+	def dump(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.is_started():
+			return
+
+		try:
+			os.makedirs(os.path.dirname(self._path), exist_ok=True)
+			self._profile.dump_stats(self._path)
+
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not write profile %s: %s", self._path, e))
+
+
+	# observer
+
+	# only the outermost instrumented call enables the profiler, as cProfile
+	# cannot be nested
+	def begin(self, name, args, kwargs):
+		if self._depth == 0:
+			try:
+				self._profile.enable()
+			except ValueError: # another profiler is active
+				pass
+
+		self._depth += 1
+
+	def end(self, name, token):
+		self._depth -= 1
+
+		if self._depth == 0:
+			self._profile.disable()
+
+
+def is_profiling_requested(settings):
+	return bool(os.environ.get(ENV_VAR)) or settings.profile
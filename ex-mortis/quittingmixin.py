@@ -26,29 +26,54 @@ gi.require_version('Gedit', '3.0')
 gi.require_version('Gio', '2.0')
 
 from gi.repository import GObject, GLib, Gedit, Gio
-from .utils import connect_handlers, disconnect_handlers
+from .compat import TAB_STATE_NORMAL, document_is_untouched, list_properties
+from .handlers import connect_handlers, disconnect_handlers
+from .instrument import instrumented, instrument_methods
+from .plugin import user_data_dir
+from .sessionjournal import ExMortisSessionJournal
+from .utils import create_bindings, release_bindings
+from .weakobjectmap import WeakObjectMap
+from .windowstate import ExMortisWindowState
+from . import metrics
 from . import log
 
 
 class ExMortisAppActivatableQuittingMixin(object):
 
-	def do_activate_quitting(self, is_saving_window_states):
+	def do_activate_quitting(self, settings, is_journaling):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("is_saving_window_states=%s", is_saving_window_states))
+			Gedit.debug_plugin_message(log.format("is_journaling=%s", is_journaling))
 
-		self._window_ids = {} if is_saving_window_states else None
+		journal = ExMortisSessionJournal(user_data_dir if is_journaling else None)
+		journal.mode = settings.persistence_mode
+
+		create_bindings(
+			self, settings, journal,
+			{'persistence-interval': 'interval'},
+			GObject.BindingFlags.SYNC_CREATE
+		)
+
+		self._window_ids = WeakObjectMap() if settings.restore_between_sessions else None
+		self._journal = journal
 		self._quitting = None
+		self._quitting_window_ids = None
 		self._restore_states = None
 		self._restore_windows = None
 
-	def do_deactivate_quitting(self):
+	def do_deactivate_quitting(self, settings):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
 		self.teardown_restore_windows()
 
+		release_bindings(self, settings, self._journal)
+
+		self._journal.cleanup()
+
 		self._window_ids = None
+		self._journal = None
 		self._quitting = None
+		self._quitting_window_ids = None
 		self._restore_states = None
 		self._restore_windows = None
 
@@ -68,10 +93,18 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 			return
 
-		self._window_ids = {}
+		self._window_ids = WeakObjectMap()
+		self._journal.mode = settings.persistence_mode
 
-		for window in self.app.get_main_windows():
-			self.bind_window_settings(window_manager, settings, window)
+		windows = [
+			window
+			for window in self.app.get_main_windows()
+			if window_manager.get_window_state(window)
+		]
+		window_ids = settings.add_windows(len(windows))
+
+		for window, window_id in zip(windows, window_ids):
+			self.bind_window_settings(window_manager, settings, window, window_id)
 
 	def stop_saving_window_states(self, window_manager, settings):
 		if log.query(log.DEBUG):
@@ -83,17 +116,23 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 			return
 
+		window_ids = []
+
 		for window in self.app.get_main_windows():
 			try:
-				self.unbind_window_settings(window_manager, settings, window)
+				window_ids.append(self.unbind_window_settings(window_manager, settings, window, False))
 			except ValueError: # gedit 3.14
 				pass
 
+		settings.remove_windows([window_id for window_id in window_ids if window_id])
+
+		self._journal.clear()
+
 		self._window_ids = None
 
-	def bind_window_settings(self, window_manager, settings, window):
+	def bind_window_settings(self, window_manager, settings, window, window_id=None):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
+			Gedit.debug_plugin_message(log.format("%s, window_id=%s", window, window_id))
 
 		if not self.is_saving_window_states():
 			if log.query(log.WARNING):
@@ -109,7 +148,9 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 			return
 
-		window_id = settings.add_window()
+		if window_id is None:
+			window_id = settings.add_window()
+
 		self._window_ids[window] = window_id
 
 		window_settings = settings.get_window_settings(window_id)
@@ -120,10 +161,12 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 			return
 
-		try:
-			params = state.list_properties()
-		except AttributeError: # gedit 3.12
-			params = GObject.list_properties(state)
+		if settings.persistence_mode != 'real-time':
+			self._journal.track(window_id, state, window_settings)
+
+			return
+
+		params = list_properties(state)
 
 		for param in params:
 			# this also immediately sets the settings based on the state values
@@ -146,9 +189,10 @@ class ExMortisAppActivatableQuittingMixin(object):
 		self.on_window_state_uris_changed(state, window_settings)
 		self.on_window_state_notebook_widths_changed(state, window_settings)
 
-	def unbind_window_settings(self, window_manager, settings, window):
+	# returns the window id, or None if the window was not bound
+	def unbind_window_settings(self, window_manager, settings, window, do_remove=True):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
+			Gedit.debug_plugin_message(log.format("%s, do_remove=%s", window, do_remove))
 
 		if not self.is_saving_window_states():
 			if log.query(log.WARNING):
@@ -162,13 +206,13 @@ class ExMortisAppActivatableQuittingMixin(object):
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Could not get state for %s", window))
 
-			return
+			return None
 
 		if window not in self._window_ids:
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Could not find window id for %s", window))
 
-			return
+			return None
 
 		window_id = self._window_ids[window]
 		window_settings = settings.get_window_settings(window_id)
@@ -177,25 +221,32 @@ class ExMortisAppActivatableQuittingMixin(object):
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Could not get settings for %s", window))
 
-			return
+			return None
 
-		try:
-			params = state.list_properties()
-		except AttributeError: # gedit 3.12
-			params = GObject.list_properties(state)
+		if self._journal.is_tracking(window_id):
+			self._journal.untrack(window_id)
 
-		for param in params:
-			try:
-				window_settings.unbind(state, param.name)
-			except ValueError: # gedit 3.14
-				pass
+		else:
+			params = list_properties(state)
 
-		disconnect_handlers(self, state)
+			for param in params:
+				try:
+					window_settings.unbind(state, param.name)
+				except ValueError: # gedit 3.14
+					pass
 
-		settings.remove_window(window_id)
+			disconnect_handlers(self, state)
 
 		del self._window_ids[window]
 
+		# windows closed while quitting are removed together when quitting ends
+		if do_remove and self.is_quitting():
+			self._quitting_window_ids.append(window_id)
+		elif do_remove:
+			settings.remove_window(window_id)
+
+		return window_id
+
 	def on_window_state_uris_changed(self, state, window_settings):
 		window_settings['uris'] = state.restore_uris
 
@@ -221,8 +272,13 @@ class ExMortisAppActivatableQuittingMixin(object):
 			for window in self.app.get_main_windows()
 		}
 
+		if self._quitting_window_ids is None:
+			self._quitting_window_ids = []
+
+		window_manager.set_quitting(True)
+
 	# can be called when not quitting
-	def cancel_quitting(self):
+	def cancel_quitting(self, window_manager, settings):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
@@ -235,7 +291,12 @@ class ExMortisAppActivatableQuittingMixin(object):
 		if log.query(log.INFO):
 			Gedit.debug_plugin_message(log.format("Cancelling quitting"))
 
+		settings.remove_windows(self._quitting_window_ids)
+
 		self._quitting = None
+		self._quitting_window_ids = None
+
+		window_manager.set_quitting(False)
 
 	# can be called when not quitting
 	def update_quitting(self, window, tab):
@@ -262,7 +323,8 @@ class ExMortisAppActivatableQuittingMixin(object):
 		state.save_uri(window, tab)
 		state.forget_tab(tab)
 
-	def end_quitting(self, settings, do_save):
+	@instrumented
+	def end_quitting(self, window_manager, settings, do_save):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("do_save=%s", do_save))
 
@@ -272,80 +334,84 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 			return
 
-		if do_save:
-			for window, state in self._quitting.items():
-				if state.restore_uris:
-					window_id = settings.add_window()
-					window_settings = settings.get_window_settings(window_id)
-
-					if not window_settings:
-						if log.query(log.WARNING):
-							Gedit.debug_plugin_message(log.format("Could not get settings for %s", window))
-						continue
+		# before saving the session, so that these windows are not also read
+		# from their per-window settings
+		settings.remove_windows(self._quitting_window_ids)
 
-					try:
-						params = state.list_properties()
-					except AttributeError: # gedit 3.12
-						params = GObject.list_properties(state)
+		if do_save:
+			# gedit is about to exit, so this is a good time to fit the
+			# windows to the screen, instead of when gedit is starting
+			screen = (window_manager.get_screen_width(), window_manager.get_screen_height())
+			states = fit_window_states(self._quitting.values(), *screen)
+			windows = [state.to_dict() for state in states]
 
-					for param in params:
-						window_settings[param.name] = state.get_property(param.name)
+			if log.query(log.MESSAGE):
+				Gedit.debug_plugin_message(log.format("Saving %s windows", len(windows)))
 
-					window_settings['uris'] = state.restore_uris
-					window_settings['notebook-widths'] = state.restore_notebook_widths
+			settings.save_session(windows, screen)
 
-			if log.query(log.MESSAGE):
-				Gedit.debug_plugin_message(log.format("Saving %s windows", len(settings.restore_windows)))
+			metrics.increment('quit.saved-windows', len(windows))
 
 		else:
 			if log.query(log.MESSAGE):
 				Gedit.debug_plugin_message(log.format("Not saving windows"))
 
 		self._quitting = None
+		self._quitting_window_ids = None
+
+	# windows that are still open (e.g. if gedit is quit by the session manager)
+	# are saved in full, then the journal is no longer needed
+	def flush_window_states(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._journal.flush()
 
 
 	# restoring
 
+	@instrumented
 	def prepare_restore_data(self, window_manager, settings):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
+		start_time = metrics.now()
+
 		if settings.have_backup:
 			if log.query(log.MESSAGE):
 				Gedit.debug_plugin_message(log.format("Restoring backup window data"))
 
-			settings.restore_backup()
+			windows, screen = settings.load_backup()
 
-		settings.save_backup()
+			# changes recorded after the backup was saved are for windows
+			# that are being discarded
+			self._journal.clear()
 
-		states = []
+		else:
+			self._journal.replay(settings)
 
-		for window_id in settings.restore_windows:
-			state = window_manager.new_window_state()
-			window_settings = settings.get_window_settings(window_id)
+			windows, screen = settings.load_session()
 
-			if not window_settings:
-				if log.query(log.WARNING):
-					Gedit.debug_plugin_message(log.format("Could not get settings for %s", window))
-				continue
+		metrics.observe_elapsed('restore.read', start_time)
+		start_time = metrics.now()
 
-			try:
-				params = state.list_properties()
-			except AttributeError: # gedit 3.12
-				params = GObject.list_properties(state)
+		settings.save_backup(windows, screen)
+		settings.clear_session()
 
-			for param in params:
-				state.set_property(
-					param.name, window_settings[param.name]
-				)
+		metrics.observe_elapsed('restore.backup', start_time)
+		start_time = metrics.now()
 
-			state.uris = window_settings['uris']
-			state.notebook_widths = window_settings['notebook-widths']
+		states = [ExMortisWindowState.from_dict(window) for window in windows]
+		screen_width = window_manager.get_screen_width()
+		screen_height = window_manager.get_screen_height()
 
-			if state.restore_uris:
-				states.append(state)
+		if screen != (screen_width, screen_height):
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Fitting windows to %sx%s screen", screen_width, screen_height))
 
-		settings.remove_windows()
+			states = fit_window_states(states, screen_width, screen_height)
+
+		metrics.observe_elapsed('restore.fit', start_time)
 
 		if not states:
 			if log.query(log.MESSAGE):
@@ -356,25 +422,6 @@ class ExMortisAppActivatableQuittingMixin(object):
 		if log.query(log.MESSAGE):
 			Gedit.debug_plugin_message(log.format("Will restore %s windows", len(states)))
 
-		screen_width = window_manager.get_screen_width()
-		screen_height = window_manager.get_screen_height()
-
-		for state in states:
-			# when gedit goes to open the first blank tab,
-			# it tries to find an active window first
-			# but it tests for windows in the current screen/workspace/viewport
-			# which is in part based on the size of the window
-			# so we need to shrink our windows here to fit the screen,
-			# otherwise gedit will think they are in a different viewport
-			# (if the window is too large for the screen,
-			# the window manager will probably resize the window to fit anyway)
-			if state.width > screen_width:
-				state.side_panel_size = round((state.side_panel_size / state.width) * screen_width)
-				state.width = screen_width
-			if state.height > screen_height:
-				state.bottom_panel_size = round((state.bottom_panel_size / state.height) * screen_height)
-				state.height = screen_height
-
 		self._restore_states = states
 		self._restore_windows = {}
 
@@ -383,7 +430,9 @@ class ExMortisAppActivatableQuittingMixin(object):
 			Gedit.debug_plugin_message(log.format(""))
 
 		settings.clear_backup()
-		settings.remove_windows()
+		settings.clear_session()
+
+		self._journal.clear()
 
 		if log.query(log.MESSAGE):
 			Gedit.debug_plugin_message(log.format("Not restoring windows"))
@@ -456,6 +505,8 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 		self.teardown_restore_windows()
 
+		self._watchdog.start_heartbeat()
+
 		def do_restore_windows():
 			self.restore_windows(window_manager, settings, window, tab)
 
@@ -463,6 +514,7 @@ class ExMortisAppActivatableQuittingMixin(object):
 
 		GLib.idle_add(do_restore_windows)
 
+	@instrumented
 	def restore_windows(self, window_manager, settings, window, tab):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, tab))
@@ -471,21 +523,12 @@ class ExMortisAppActivatableQuittingMixin(object):
 		num_tabs = len(active_tab.get_parent().get_children())
 
 		document = tab.get_document()
-		try:
-			is_untouched = document.is_untouched() # removed in gedit 44
-		except AttributeError:
-			is_untouched = document_is_untouched(document)
-
-		try:
-			normal_state = Gedit.TabState.NORMAL
-		except AttributeError:
-			normal_state = Gedit.TabState.STATE_NORMAL # before gedit 47
 
 		is_single_empty_tab = (
 			num_tabs == 1
 			and tab is active_tab
-			and is_untouched
-			and tab.get_state() == normal_state
+			and document_is_untouched(document)
+			and tab.get_state() == TAB_STATE_NORMAL
 		)
 
 		# if there is only one empty tab, let gedit reuse it when opening files
@@ -499,27 +542,57 @@ class ExMortisAppActivatableQuittingMixin(object):
 		if not is_single_empty_tab:
 			window.create_tab(True)
 
+		start_time = metrics.now()
+
 		state = self._restore_states.pop()
 		window_manager.import_window_state(window, state)
 
+		metrics.observe_elapsed('restore.import', start_time)
+		start_time = metrics.now()
+
 		for state in self._restore_states:
 			window_manager.open_new_window_with_window_state(state)
 
+		metrics.observe_elapsed('restore.open-windows', start_time)
+		metrics.increment('restore.windows', len(self._restore_states) + 1)
+		start_time = metrics.now()
+
 		settings.clear_backup()
 
+		metrics.observe_elapsed('restore.clear-backup', start_time)
+
 		self._restore_states = None
 
 		if not is_single_empty_tab:
 			window.set_active_tab(active_tab)
 			window.present()
 
-# based on tepl_buffer_is_untouched() in tepl-buffer.c
-def document_is_untouched(document):
-	return (
-		document.get_char_count() == 0
-		and not document.get_modified()
-		and not document.can_undo()
-		and not document.can_redo()
-		and document.get_file().get_location() is None
-	)
-
+# drops empty windows and fits windows to the screen
+def fit_window_states(states, screen_width, screen_height):
+	fitted = []
+
+	for state in states:
+		if not state.restore_uris:
+			continue
+
+		# when gedit goes to open the first blank tab,
+		# it tries to find an active window first
+		# but it tests for windows in the current screen/workspace/viewport
+		# which is in part based on the size of the window
+		# so we need to shrink our windows here to fit the screen,
+		# otherwise gedit will think they are in a different viewport
+		# (if the window is too large for the screen,
+		# the window manager will probably resize the window to fit anyway)
+		if state.width > screen_width:
+			state.side_panel_size = round((state.side_panel_size / state.width) * screen_width)
+			state.width = screen_width
+		if state.height > screen_height:
+			state.bottom_panel_size = round((state.bottom_panel_size / state.height) * screen_height)
+			state.height = screen_height
+
+		fitted.append(state)
+
+	return fitted
+
+# signal handlers and timeout / idle callbacks
+instrument_methods(ExMortisAppActivatableQuittingMixin, ('on_',))
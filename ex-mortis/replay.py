@@ -0,0 +1,783 @@
+# -*- coding: utf-8 -*-
+#
+# replay.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+# replays a trace recorded by tracerecorder.py into the window manager and
+# window state classes, with fake gedit / gtk objects, without a display:
+#
+#     python3 replay.py [--profile FILE] [--metrics FILE] TRACE
+#
+# the recorded window values are applied to the fake windows before each
+# call, so the window manager reads what it read when the trace was recorded;
+# window changes made by the window manager itself (e.g. opening files when
+# importing a state) are not applied, the changes that followed are in the
+# trace as later calls
+#
+# plugin modules are loaded through a synthetic package, so that the plugin's
+# __init__.py (and gedit / libpeas) are not loaded
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('Gio', '2.0')
+
+import argparse
+import cProfile
+import gzip
+import importlib
+import json
+import os.path
+import sys
+import tempfile
+import time
+import traceback
+import types
+from gi.repository import GObject, Gio
+
+
+PACKAGE_NAME = 'exmortisreplay'
+
+FAKE_NAMESPACES = ('Gdk', 'Gedit', 'Gtk', 'Peas', 'PeasGtk')
+
+TRACE_VERSION = 1
+
+
+# fake widgets
+#
+# values are kept in plain attributes instead of properties, so that applying
+# recorded values does not emit notify signals (the recorded calls are made
+# directly instead)
+
+class ExMortisFakeAllocation(object):
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+
+
+class ExMortisFakeWidget(GObject.Object):
+
+	__gtype_name__ = 'ExMortisFakeWidget'
+
+	__gsignals__ = {
+		'destroy': (GObject.SignalFlags.RUN_LAST, None, ())
+	}
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		self.parent = None
+		self.children = []
+		self.width = 0
+		self.height = 0
+		self.visible = True
+
+	def get_parent(self):
+		return self.parent
+
+	def get_children(self):
+		return list(self.children)
+
+	def get_allocation(self):
+		return ExMortisFakeAllocation(self.width, self.height)
+
+	def get_visible(self):
+		return self.visible
+
+	def get_mapped(self):
+		return self.visible
+
+	def set_visible(self, visible):
+		pass
+
+	def show(self):
+		pass
+
+
+class ExMortisFakePaned(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakePaned'
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.position = 0
+		self.child2 = None
+
+	def get_position(self):
+		return self.position
+
+	def set_position(self, position):
+		pass
+
+	def get_child2(self):
+		return self.child2
+
+
+class ExMortisFakeStack(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakeStack'
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.visible_child_name = ''
+
+	def get_visible_child_name(self):
+		return self.visible_child_name
+
+	def set_visible_child_name(self, name):
+		pass
+
+
+class ExMortisFakePanel(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakePanel'
+
+	__gsignals__ = {
+		'changed': (GObject.SignalFlags.RUN_LAST, None, ())
+	}
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.active_item_name = ''
+
+	def get_active_item_name(self):
+		return self.active_item_name
+
+	def set_active_item_name(self, name):
+		pass
+
+
+class ExMortisFakeMultiNotebook(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakeMultiNotebook'
+
+	__gsignals__ = {
+		'notebook-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'notebook-removed': (GObject.SignalFlags.RUN_LAST, None, (object,))
+	}
+
+
+class ExMortisFakeNotebook(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakeNotebook'
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.tabs = []
+
+	def get_nth_page(self, index):
+		return self.tabs[index] if -len(self.tabs) <= index < len(self.tabs) else None
+
+	def get_n_pages(self):
+		return len(self.tabs)
+
+	def page_num(self, tab):
+		return self.tabs.index(tab) if tab in self.tabs else -1
+
+	def reorder_child(self, tab, position):
+		pass
+
+
+class ExMortisFakeDocument(GObject.Object):
+
+	__gtype_name__ = 'ExMortisFakeDocument'
+
+
+	def __init__(self, tab):
+		GObject.Object.__init__(self)
+
+		self.tab = tab
+		self.location = None
+
+	# also stands in for the document's GtkSourceFile
+	def get_file(self):
+		return self
+
+	def get_location(self):
+		return self.location
+
+	def get_modified(self):
+		return False
+
+
+class ExMortisFakeTab(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakeTab'
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.document = ExMortisFakeDocument(self)
+		self.window = None
+
+	def get_document(self):
+		return self.document
+
+	def get_toplevel(self):
+		return self.window
+
+	@staticmethod
+	def get_from_document(document):
+		return document.tab
+
+
+class ExMortisFakeGdkWindow(object):
+
+	def __init__(self, state):
+		self.state = state
+
+	def get_state(self):
+		return self.state
+
+
+class ExMortisFakeWindow(ExMortisFakeWidget):
+
+	__gtype_name__ = 'ExMortisFakeWindow'
+
+	__gsignals__ = {
+		'tab-added': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'tab-removed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'active-tab-changed': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'configure-event': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'window-state-event': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'size-allocate': (GObject.SignalFlags.RUN_LAST, None, (object,))
+	}
+
+
+	def __init__(self):
+		ExMortisFakeWidget.__init__(self)
+
+		self.template_children = {
+			'multi_notebook': ExMortisFakeMultiNotebook(),
+			'side_panel': ExMortisFakeStack(),
+			'bottom_panel': ExMortisFakeStack(),
+			'hpaned': ExMortisFakePaned(),
+			'vpaned': ExMortisFakePaned()
+		}
+		self.side_panel = self.template_children['side_panel']
+		self.bottom_panel = self.template_children['bottom_panel']
+		self.notebooks = []
+		self.active_tab = None
+		self.size = (0, 0)
+		self.default_size = (-1, -1)
+		self.window_state = None
+
+	def get_template_child(self, widget_type, name):
+		return self.template_children[name]
+
+	def get_side_panel(self):
+		return self.side_panel
+
+	def get_bottom_panel(self):
+		return self.bottom_panel
+
+	def get_documents(self):
+		return [tab.document for notebook in self.notebooks for tab in notebook.tabs]
+
+	def get_active_tab(self):
+		return self.active_tab
+
+	def set_active_tab(self, tab):
+		pass
+
+	def get_tab_from_location(self, location):
+		for notebook in self.notebooks:
+			for tab in notebook.tabs:
+				tab_location = tab.document.location
+
+				if tab_location and tab_location.equal(location):
+					return tab
+
+		return None
+
+	def get_size(self):
+		return self.size
+
+	def get_default_size(self):
+		return self.default_size
+
+	def get_window(self):
+		return ExMortisFakeGdkWindow(self.window_state) if self.window_state is not None else None
+
+	def set_default_size(self, width, height):
+		pass
+
+	def resize(self, width, height):
+		pass
+
+	def maximize(self):
+		pass
+
+	def unmaximize(self):
+		pass
+
+	def fullscreen(self):
+		pass
+
+	def unfullscreen(self):
+		pass
+
+	def present(self):
+		pass
+
+	def close_tab(self, tab):
+		pass
+
+	def create_tab(self, jump_to):
+		return ExMortisFakeTab()
+
+	def activate_action(self, name, parameter=None):
+		pass
+
+	# there are no frames, held back layout operations are not applied
+	def add_tick_callback(self, callback, *args):
+		return 0
+
+
+class ExMortisFakeApp(GObject.Object):
+
+	__gtype_name__ = 'ExMortisFakeApp'
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		self.windows = []
+
+	def get_main_windows(self):
+		return list(self.windows)
+
+	def create_window(self, screen=None):
+		return ExMortisFakeWindow()
+
+	def add_window(self, window):
+		pass
+
+	def remove_window(self, window):
+		pass
+
+
+class ExMortisFakeScreen(object):
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+
+	def get_width(self):
+		return self.width
+
+	def get_height(self):
+		return self.height
+
+
+# replaying
+
+class ExMortisReplayer(GObject.Object):
+
+	__gtype_name__ = 'ExMortisReplayer'
+
+
+	def __init__(self, package, is_verbose=False):
+		GObject.Object.__init__(self)
+
+		self._package = package
+		self._is_verbose = is_verbose
+		self._app = ExMortisFakeApp()
+		self._window_manager = package.windowmanager.ExMortisWindowManager(self._app)
+		self._objects = {}
+		# method -> [count, total seconds, max seconds]
+		self._timings = {}
+		self._errors = 0
+
+	def cleanup(self):
+		self._window_manager.cleanup()
+		self._window_manager = None
+		self._objects = None
+
+	def replay(self, lines):
+		for line in lines:
+			t, method, args, kwargs, window_values = line
+
+			for window_id, values in window_values.items():
+				self.apply_window_values(self.get_object(int(window_id), ExMortisFakeWindow), values)
+
+			window = self.find_window(args)
+			args = [self.decode_arg(arg, window) for arg in args]
+			kwargs = dict((key, self.decode_arg(value, window)) for key, value in kwargs.items())
+
+			self.update_app_windows(method, window)
+
+			start_time = time.perf_counter()
+
+			try:
+				getattr(self._window_manager, method)(*args, **kwargs)
+
+			except Exception:
+				self._errors += 1
+
+				if self._is_verbose:
+					print("Error replaying %s at %s ms:" % (method, t), file=sys.stderr)
+					traceback.print_exc()
+
+			elapsed = time.perf_counter() - start_time
+			timing = self._timings.setdefault(method, [0, 0, 0])
+			timing[0] += 1
+			timing[1] += elapsed
+			timing[2] = max(timing[2], elapsed)
+
+	def get_summary(self):
+		return {
+			'errors': self._errors,
+			'calls': dict(
+				(method, {
+					'count': count,
+					'total_ms': total * 1000,
+					'max_ms': maximum * 1000
+				})
+				for method, (count, total, maximum) in sorted(self._timings.items())
+			)
+		}
+
+
+	# objects
+
+	def get_object(self, object_id, cls=None, type_name=None):
+		if object_id is None:
+			return None
+
+		obj = self._objects.get(object_id)
+
+		if obj is None:
+			if not cls:
+				cls = get_fake_class(type_name)
+
+			obj = cls()
+			self._objects[object_id] = obj
+
+		return obj
+
+	def find_window(self, args):
+		for arg in args:
+			if isinstance(arg, dict) and 'o' in arg and get_fake_class(arg.get('t')) is ExMortisFakeWindow:
+				return self.get_object(arg['o'], ExMortisFakeWindow)
+
+		return None
+
+	def decode_arg(self, arg, window):
+		if not isinstance(arg, dict):
+			return arg
+
+		if 'o' in arg:
+			if arg.get('t') == 'ExMortisWindowState':
+				if 's' in arg:
+					return self._package.windowstate.ExMortisWindowState.from_dict(arg['s'])
+
+				# a tracked state, i.e. the window manager's own state for the window
+				return self._window_manager.get_window_state(window) if window else None
+
+			return self.get_object(arg['o'], type_name=arg.get('t'))
+
+		if 'p' in arg:
+			return types.SimpleNamespace(name=arg['p'])
+
+		if arg.get('e') == 'window-state':
+			return types.SimpleNamespace(new_window_state=arg['ws'])
+
+		if arg.get('e') == 'configure':
+			return types.SimpleNamespace(width=arg['w'], height=arg['h'])
+
+		return None
+
+	def update_app_windows(self, method, window):
+		windows = self._app.windows
+
+		if method == 'track_window' and window not in windows:
+			windows.append(window)
+		elif method == 'untrack_window' and window in windows:
+			windows.remove(window)
+
+
+	# window values
+
+	def apply_window_values(self, window, values):
+		children = window.template_children
+
+		if 'multi-notebook' in values:
+			self._objects[values['multi-notebook']] = children['multi_notebook']
+
+		if 'size' in values:
+			window.size = tuple(values['size'])
+
+		if 'default-size' in values:
+			window.default_size = tuple(values['default-size'])
+
+		if 'window-state' in values:
+			window.window_state = values['window-state']
+
+		if 'side-panel' in values:
+			window.side_panel = self.apply_panel_values(children, 'side_panel', values['side-panel'])
+
+		if 'bottom-panel' in values:
+			window.bottom_panel = self.apply_panel_values(children, 'bottom_panel', values['bottom-panel'])
+
+		if 'hpaned' in values:
+			hpaned_id, position = values['hpaned']
+			self._objects[hpaned_id] = children['hpaned']
+			children['hpaned'].position = position
+
+		if 'vpaned' in values:
+			vpaned_id, position, height = values['vpaned']
+			self._objects[vpaned_id] = children['vpaned']
+			children['vpaned'].position = position
+			children['vpaned'].height = height
+
+		if 'notebooks' in values:
+			self.apply_notebook_values(window, values['notebooks'])
+
+		if 'paneds' in values:
+			self.apply_paned_values(window, values['paneds'])
+
+		if 'active-tab' in values:
+			window.active_tab = self.get_object(values['active-tab'], ExMortisFakeTab)
+
+	def apply_panel_values(self, children, name, values):
+		whole_panel_id, panel_id, page_name, visible = values
+		whole_panel = children[name]
+
+		self._objects[whole_panel_id] = whole_panel
+		whole_panel.visible = visible
+
+		if panel_id == whole_panel_id:
+			whole_panel.visible_child_name = page_name or ''
+
+			return whole_panel
+
+		panel = self.get_object(panel_id, ExMortisFakePanel)
+		panel.active_item_name = page_name or ''
+
+		return panel
+
+	def apply_notebook_values(self, window, values):
+		multi_notebook = window.template_children['multi_notebook']
+		notebooks = []
+
+		for notebook_id, parent_id, width, tab_values in values:
+			notebook = self.get_object(notebook_id, ExMortisFakeNotebook)
+			notebook.parent = self.get_object(parent_id, ExMortisFakePaned)
+			notebook.width = width
+			notebook.tabs = []
+
+			for tab_id, uri in tab_values:
+				tab = self.get_object(tab_id, ExMortisFakeTab)
+				tab.parent = notebook
+				tab.window = window
+				tab.document.location = Gio.File.new_for_uri(uri) if uri else None
+				notebook.tabs.append(tab)
+
+			notebooks.append(notebook)
+
+		window.notebooks = notebooks
+
+		if len(notebooks) == 1:
+			multi_notebook.children = notebooks
+
+	def apply_paned_values(self, window, values):
+		multi_notebook = window.template_children['multi_notebook']
+		paneds = []
+
+		# the window manager only walks the paneds, so nesting is not needed
+		for paned_id, position, child2_id in values:
+			paned = self.get_object(paned_id, ExMortisFakePaned)
+			paned.position = position
+			paned.child2 = self.get_object(child2_id, ExMortisFakeWidget)
+			paned.children = []
+			paneds.append(paned)
+
+		if paneds:
+			multi_notebook.children = paneds
+
+
+def get_fake_class(type_name):
+	type_name = type_name or ''
+
+	if type_name.endswith('Window'):
+		return ExMortisFakeWindow
+	if type_name.endswith('MultiNotebook'):
+		return ExMortisFakeMultiNotebook
+	if type_name.endswith('Notebook'):
+		return ExMortisFakeNotebook
+	if type_name.endswith('Tab'):
+		return ExMortisFakeTab
+	if type_name.endswith('Paned'):
+		return ExMortisFakePaned
+
+	return ExMortisFakeWidget
+
+def read_trace(path):
+	opener = gzip.open if path.endswith('.gz') else open
+
+	with opener(path, 'rt', encoding='utf-8') as f:
+		header = json.loads(f.readline())
+		lines = [json.loads(line) for line in f if line.strip()]
+
+	if header.get('version') != TRACE_VERSION:
+		raise ValueError("Unsupported trace version %s" % header.get('version'))
+
+	return header, lines
+
+def create_fake_modules(screen_size, is_verbose):
+	def debug_plugin_message(message):
+		if is_verbose:
+			print(message, file=sys.stderr)
+
+	def commands_load_locations(window, locations, encoding, line_pos, column_pos):
+		pass
+
+	ExMortisFakeTab.get_from_document = staticmethod(lambda document: document.tab)
+
+	gedit = types.ModuleType('Gedit')
+	gedit.App = ExMortisFakeApp
+	gedit.Window = ExMortisFakeWindow
+	gedit.Tab = ExMortisFakeTab
+	gedit.Notebook = ExMortisFakeNotebook
+	gedit.Document = ExMortisFakeDocument
+	gedit.TabState = types.SimpleNamespace(NORMAL=0)
+	gedit.debug_plugin_message = debug_plugin_message
+	gedit.commands_load_locations = commands_load_locations
+
+	gtk = types.ModuleType('Gtk')
+	gtk.Widget = ExMortisFakeWidget
+	gtk.Paned = ExMortisFakePaned
+	gtk.Notebook = ExMortisFakeNotebook
+	gtk.Stack = ExMortisFakeStack
+
+	screen = ExMortisFakeScreen(*screen_size)
+
+	gdk = types.ModuleType('Gdk')
+	gdk.Event = types.SimpleNamespace
+	gdk.Screen = types.SimpleNamespace(get_default=lambda: screen)
+	gdk.WindowState = types.SimpleNamespace(MAXIMIZED=1 << 2, FULLSCREEN=1 << 4)
+
+	return {
+		'Gedit': gedit,
+		'Gtk': gtk,
+		'Gdk': gdk,
+		'Peas': types.ModuleType('Peas'),
+		'PeasGtk': types.ModuleType('PeasGtk')
+	}
+
+def install_fake_modules(modules):
+	import gi.repository
+
+	require_version = gi.require_version
+
+	def fake_require_version(namespace, version):
+		if namespace not in FAKE_NAMESPACES:
+			require_version(namespace, version)
+
+	gi.require_version = fake_require_version
+
+	for name, module in modules.items():
+		sys.modules['gi.repository.' + name] = module
+		setattr(gi.repository, name, module)
+
+def load_package(cache_dir):
+	directory = os.path.dirname(os.path.abspath(__file__))
+
+	package = types.ModuleType(PACKAGE_NAME)
+	package.__path__ = [directory]
+	sys.modules[PACKAGE_NAME] = package
+
+	plugin = types.ModuleType(PACKAGE_NAME + '.plugin')
+	plugin.data_dir = directory
+	plugin.user_data_dir = cache_dir
+	plugin.user_cache_dir = cache_dir
+	plugin._ = lambda s: s
+	sys.modules[plugin.__name__] = plugin
+	package.plugin = plugin
+
+	for name in ('metrics', 'windowstate', 'windowmanager'):
+		setattr(package, name, importlib.import_module(PACKAGE_NAME + '.' + name))
+
+	return package
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Replay an Ex-Mortis trace without gedit")
+	parser.add_argument('trace', help="trace file, as recorded with the trace setting")
+	parser.add_argument('--profile', metavar='FILE', help="write a cProfile .pstats file of the replay")
+	parser.add_argument('--metrics', metavar='FILE', help="write the plugin's metrics as JSON")
+	parser.add_argument('--verbose', action='store_true', help="print plugin log messages and errors")
+	args = parser.parse_args(argv)
+
+	header, lines = read_trace(args.trace)
+
+	install_fake_modules(create_fake_modules(header.get('screen') or (1920, 1080), args.verbose))
+
+	with tempfile.TemporaryDirectory() as cache_dir:
+		package = load_package(cache_dir)
+		package.metrics.start_timing_calls()
+
+		replayer = ExMortisReplayer(package, args.verbose)
+		profile = cProfile.Profile() if args.profile else None
+		start_time = time.perf_counter()
+
+		if profile:
+			profile.enable()
+
+		replayer.replay(lines)
+
+		if profile:
+			profile.disable()
+			profile.dump_stats(args.profile)
+
+		elapsed = time.perf_counter() - start_time
+
+		replayer.cleanup()
+
+		summary = replayer.get_summary()
+		summary['lines'] = len(lines)
+		summary['total_ms'] = elapsed * 1000
+
+		if args.metrics:
+			with open(args.metrics, 'w') as f:
+				json.dump(package.metrics.get_snapshot(), f, indent=1, sort_keys=True)
+
+	json.dump(summary, sys.stdout, indent=1)
+	print()
+
+	return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+	# do not let plugin modules shadow standard modules when run as a script
+	script_directory = os.path.dirname(os.path.abspath(__file__))
+	sys.path = [path for path in sys.path if os.path.abspath(path or '.') != script_directory]
+
+	sys.exit(main())
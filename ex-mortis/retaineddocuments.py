@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# retaineddocuments.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+gi.require_version('Gio', '2.0')
+
+from collections import OrderedDict
+from gi.repository import GObject, GLib, Gedit, Gio
+from .compat import HAS_DOCUMENT_GET_FILE
+from .handlers import connect_handlers, disconnect_handlers
+from .instrument import instrument_methods
+from . import log
+
+
+# gedit does not allow an existing document to be attached to a new tab,
+# so instead of keeping closed documents alive, we keep their contents and
+# fill new tabs with them when the window is reopened
+#
+# only unmodified, local, uncompressed utf-8 documents with unix line endings
+# are retained, since there is no way to give the new document a different
+# encoding, line ending or compression type without loading it (these are
+# also what an unloaded document is saved with)
+#
+# the new document is not loaded, so gedit does not know the file's
+# modification time, and cannot tell if the file is changed by another
+# program while it is open; the cursor position is kept with the contents,
+# since gedit only restores it from the file's metadata when loading
+#
+# retained files are monitored, and released early if their modification
+# time changes; monitor events are asynchronous, so the modification time is
+# still checked when a document is taken
+
+class ExMortisRetainedDocuments(GObject.Object):
+
+	__gtype_name__ = 'ExMortisRetainedDocuments'
+
+	# seconds, 0 to disable
+	timeout = GObject.Property(type=int, default=0)
+
+	# megabytes
+	max_size = GObject.Property(type=int, default=16)
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._documents = OrderedDict()
+		self._size = 0
+		self._timeout_id = None
+
+		self.connect('notify::timeout', self.on_notify_limit)
+		self.connect('notify::max-size', self.on_notify_limit)
+
+	def cleanup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.clear()
+
+	def __len__(self):
+		return len(self._documents)
+
+
+	# retaining
+
+	def is_enabled(self):
+		return self.timeout > 0 and self.max_size > 0
+
+	def retain(self, tab):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s", tab))
+
+		if not self.is_enabled():
+			return False
+
+		if not HAS_DOCUMENT_GET_FILE: # gedit 3.12
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Cannot retain documents"))
+
+			return False
+
+		document = tab.get_document()
+		source_file = document.get_file()
+		location = source_file.get_location()
+
+		if not location or not location.is_native():
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Not a local file"))
+
+			return False
+
+		if document.get_modified():
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Document is modified"))
+
+			return False
+
+		if not can_retain_file(source_file):
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Unsupported encoding, line ending or compression"))
+
+			return False
+
+		modification_time = get_modification_time(location)
+
+		if modification_time is None:
+			return False
+
+		text = document.get_text(document.get_start_iter(), document.get_end_iter(), True)
+		size = len(text.encode('utf-8'))
+
+		if size > self.max_size * 1024 * 1024:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Document too large to retain"))
+
+			return False
+
+		uri = location.get_uri()
+
+		self.release(uri)
+
+		try:
+			monitor = location.monitor_file(Gio.FileMonitorFlags.NONE, None)
+		except GLib.Error as e:
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Could not monitor %s: %s", uri, e))
+
+			monitor = None
+
+		if monitor:
+			connect_handlers(self, monitor, ['changed'], 'monitor', uri)
+
+		self._documents[uri] = (
+			text,
+			document.get_language(),
+			document.get_iter_at_mark(document.get_insert()).get_offset(),
+			size,
+			modification_time,
+			GLib.get_monotonic_time() + self.timeout * 1000000,
+			monitor
+		)
+		self._size += size
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Retained %s (%s bytes)", uri, size))
+
+		self.enforce_limits()
+
+		return True
+
+	def take(self, uri):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s", uri))
+
+		if uri not in self._documents:
+			return None
+
+		text, language, cursor_offset, size, modification_time, expire_time, monitor = self._documents[uri]
+
+		self.release(uri)
+
+		# the file may have been changed since it was closed, before the
+		# monitor has reported it
+		if get_modification_time(Gio.File.new_for_uri(uri)) != modification_time:
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("File has changed since closing %s", uri))
+
+			return None
+
+		return (text, language, cursor_offset)
+
+	def release(self, uri):
+		if uri not in self._documents:
+			return
+
+		text, language, cursor_offset, size, modification_time, expire_time, monitor = self._documents.pop(uri)
+		self._size -= size
+
+		if monitor:
+			disconnect_handlers(self, monitor)
+			monitor.cancel()
+
+	def clear(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		for uri in list(self._documents.keys()):
+			self.release(uri)
+
+		self.cancel_timeout()
+
+
+	# limits
+
+	def enforce_limits(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.is_enabled():
+			self.clear()
+			return
+
+		documents = self._documents
+		max_size = self.max_size * 1024 * 1024
+		now = GLib.get_monotonic_time()
+
+		# oldest first
+		for uri in list(documents.keys()):
+			text, language, cursor_offset, size, modification_time, expire_time, monitor = documents[uri]
+
+			if expire_time > now and self._size <= max_size:
+				break
+
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Releasing %s", uri))
+
+			self.release(uri)
+
+		self.schedule_timeout()
+
+	def schedule_timeout(self):
+		self.cancel_timeout()
+
+		if not self._documents:
+			return
+
+		text, language, cursor_offset, size, modification_time, expire_time, monitor = next(iter(self._documents.values()))
+		delay = max(expire_time - GLib.get_monotonic_time(), 0) // 1000
+
+		self._timeout_id = GLib.timeout_add(delay + 1, self.on_timeout)
+
+	def cancel_timeout(self):
+		if self._timeout_id is not None:
+			GLib.source_remove(self._timeout_id)
+			self._timeout_id = None
+
+	def on_timeout(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._timeout_id = None
+
+		self.enforce_limits()
+
+		return False
+
+	def on_monitor_changed(self, monitor, file, other_file, event_type, uri):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, %s", uri, event_type.value_nick))
+
+		if uri not in self._documents:
+			return
+
+		text, language, cursor_offset, size, modification_time, expire_time, monitor = self._documents[uri]
+
+		if get_modification_time(Gio.File.new_for_uri(uri)) != modification_time:
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("File has changed, releasing %s", uri))
+
+			self.release(uri)
+
+	def on_notify_limit(self, retained, pspec):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s=%s", pspec.name, self.get_property(pspec.name)))
+
+		self.enforce_limits()
+
+
+def can_retain_file(source_file):
+	encoding = source_file.get_encoding()
+
+	return (
+		(encoding is None or encoding.get_charset() == 'UTF-8')
+		and source_file.get_newline_type().value_nick == 'lf'
+		and source_file.get_compression_type().value_nick == 'none'
+	)
+
+def get_modification_time(location):
+	try:
+		info = location.query_info(
+			Gio.FILE_ATTRIBUTE_TIME_MODIFIED + ',' + Gio.FILE_ATTRIBUTE_TIME_MODIFIED_USEC,
+			Gio.FileQueryInfoFlags.NONE,
+			None
+		)
+	except GLib.Error:
+		return None
+
+	return (
+		info.get_attribute_uint64(Gio.FILE_ATTRIBUTE_TIME_MODIFIED),
+		info.get_attribute_uint32(Gio.FILE_ATTRIBUTE_TIME_MODIFIED_USEC)
+	)
+
+def fill_tab(tab, uri, text, language, cursor_offset):
+	document = tab.get_document()
+
+	document.begin_not_undoable_action()
+	document.set_text(text)
+	document.end_not_undoable_action()
+
+	document.get_file().set_location(Gio.File.new_for_uri(uri))
+
+	if language:
+		document.set_language(language)
+
+	document.place_cursor(document.get_iter_at_offset(cursor_offset))
+	document.set_modified(False)
+
+	tab.get_view().scroll_to_mark(document.get_insert(), 0.25, False, 0, 0)
+
+
+# signal handlers and timeout / idle callbacks
+instrument_methods(ExMortisRetainedDocuments, ('on_',))
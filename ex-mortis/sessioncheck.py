@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# sessioncheck.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+gi.require_version('Gio', '2.0')
+
+from gi.repository import GLib, Gedit, Gio
+from .settings import (
+	SCHEMA_ID, WINDOW_ID_PREFIX, get_settings, get_window_settings,
+	release_window_settings, parse_window_id, pack_session, unpack_session
+)
+from . import metrics
+from . import log
+
+
+# check_session() validates the saved session and, if do_repair is true,
+# prunes what it finds:
+#
+# - orphaned window settings: restore-windows/windowN/ and
+#   backup-restore-windows/windowN/ paths that have values but are not in
+#   restore-windows / backup-restore-windows (e.g. left by a crash)
+# - duplicated or invalid ids in restore-windows / backup-restore-windows
+# - corrupt window values: negative sizes, or notebook widths that do not
+#   match the notebooks
+# - over-long uri lists: uris open more than once in a window, or more than
+#   MAX_WINDOW_URIS uris
+#
+# window values are checked in the per-window settings and in the session
+# and backup session
+#
+# gsettings cannot list the paths under a relocatable schema, so orphaned
+# paths are found by probing window ids from 'window0' until MAX_PROBE_GAP
+# ids in a row are unused; window ids are allocated lowest first, so orphans
+# are not far past the ids in use
+#
+# this is run at idle after startup, and by fsck.py when gedit is not running;
+# when run in gedit (with live_settings), the settings of windows in use are
+# not checked, as their window states would write them again
+
+MAX_WINDOW_URIS = 1000
+
+MAX_PROBE_GAP = 16
+
+SIZE_KEYS = ('width', 'height', 'side-panel-size', 'bottom-panel-size')
+
+# returns a report of the problems found, with the number of bytes of settings
+# values that were (or would be) reclaimed, or None if the settings could not
+# be loaded
+def check_session(do_repair=False, live_settings=None):
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("do_repair=%s, is_live=%s", do_repair, live_settings is not None))
+
+	settings = get_settings(SCHEMA_ID)
+
+	if not settings:
+		if log.query(log.WARNING):
+			Gedit.debug_plugin_message(log.format("Could not get settings"))
+
+		return None
+
+	start_time = metrics.now()
+
+	report = {
+		'orphaned-windows': 0,
+		'duplicate-ids': 0,
+		'invalid-ids': 0,
+		'corrupt-values': 0,
+		'trimmed-uris': 0,
+		'reclaimed-bytes': 0
+	}
+
+	for key, backup in [('restore-windows', False), ('backup-restore-windows', True)]:
+		if live_settings and not backup:
+			window_ids = live_settings.get_window_ids()
+
+		else:
+			window_ids = check_window_ids(settings, key, report, do_repair)
+
+			for window_id in window_ids:
+				check_window_settings(get_window_settings(window_id, backup), report, do_repair)
+
+		check_orphans(window_ids, backup, report, do_repair)
+
+	for key in ['session', 'backup-session']:
+		check_session_value(settings, key, report, do_repair)
+
+	if do_repair:
+		Gio.Settings.sync()
+
+	metrics.observe_elapsed('fsck', start_time)
+
+	for name, value in report.items():
+		metrics.increment('fsck.' + name, value)
+
+	if log.query(log.MESSAGE):
+		Gedit.debug_plugin_message(log.format("%s session: %s", "Repaired" if do_repair else "Checked", report))
+
+	return report
+
+# returns the valid, unique window ids
+def check_window_ids(settings, key, report, do_repair):
+	window_ids = settings[key]
+	results = []
+
+	for window_id in window_ids:
+		if parse_window_id(window_id) is None:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Invalid window id %s in %s", window_id, key))
+
+			report['invalid-ids'] += 1
+
+		elif window_id in results:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Duplicate window id %s in %s", window_id, key))
+
+			report['duplicate-ids'] += 1
+
+		else:
+			results.append(window_id)
+
+	if len(results) != len(window_ids):
+		report['reclaimed-bytes'] += (
+			settings.get_value(key).get_size()
+			- GLib.Variant('as', results).get_size()
+		)
+
+		if do_repair:
+			settings[key] = results
+
+	return results
+
+def check_window_settings(window_settings, report, do_repair):
+	if not window_settings:
+		return
+
+	window = {key : window_settings[key] for key in window_settings.keys()}
+
+	for key, value in check_window(window, report).items():
+		size = window_settings.get_value(key).get_size()
+
+		if value is None:
+			report['reclaimed-bytes'] += size
+
+			if do_repair:
+				window_settings.reset(key)
+
+		else:
+			report['reclaimed-bytes'] += size - GLib.Variant('aas', value).get_size()
+
+			if do_repair:
+				window_settings[key] = value
+
+def check_orphans(window_ids, backup, report, do_repair):
+	window_id_set = set(window_ids)
+	number = 0
+	gap = 0
+
+	while gap < MAX_PROBE_GAP:
+		window_id = WINDOW_ID_PREFIX + str(number)
+		number += 1
+
+		if window_id in window_id_set:
+			gap = 0
+			continue
+
+		window_settings = get_window_settings(window_id, backup)
+
+		if not window_settings:
+			return
+
+		values = [window_settings.get_user_value(key) for key in window_settings.keys()]
+		size = sum(value.get_size() for value in values if value is not None)
+
+		if any(value is not None for value in values):
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Orphaned window id %s, backup=%s", window_id, backup))
+
+			report['orphaned-windows'] += 1
+			report['reclaimed-bytes'] += size
+
+			if do_repair:
+				for key in window_settings.keys():
+					window_settings.reset(key)
+
+			gap = 0
+
+		else:
+			gap += 1
+
+		release_window_settings(window_id, backup)
+
+def check_session_value(settings, key, report, do_repair):
+	value = settings.get_value(key)
+	windows, screen = unpack_session(settings[key])
+	is_changed = False
+
+	for window in windows:
+		for window_key, window_value in check_window(window, report).items():
+			if window_value is None:
+				del window[window_key]
+			else:
+				window[window_key] = window_value
+
+			is_changed = True
+
+	if not is_changed:
+		return
+
+	session = pack_session(windows, screen)
+	report['reclaimed-bytes'] += value.get_size() - GLib.Variant('a{sv}', session).get_size()
+
+	if do_repair:
+		settings[key] = session
+
+# returns the values to change in the window dict, with None for values to
+# reset
+def check_window(window, report):
+	fixes = {}
+
+	for key in SIZE_KEYS:
+		if window.get(key, 0) < 0:
+			fixes[key] = None
+
+	uris = window.get('uris', [])
+	trimmed_uris = trim_uris(uris)
+	num_trimmed = sum(len(notebook_uris) for notebook_uris in uris) - sum(len(notebook_uris) for notebook_uris in trimmed_uris)
+
+	if num_trimmed:
+		fixes['uris'] = trimmed_uris
+		report['trimmed-uris'] += num_trimmed
+
+	notebook_widths = window.get('notebook-widths', [])
+
+	if notebook_widths and len(notebook_widths) != len(trimmed_uris):
+		fixes['notebook-widths'] = None
+
+	report['corrupt-values'] += sum(1 for value in fixes.values() if value is None)
+
+	return fixes
+
+# removes uris open more than once (empty uris are untitled documents) and
+# uris past MAX_WINDOW_URIS, and notebooks left empty by this
+def trim_uris(uris):
+	seen = set()
+	num_uris = 0
+	results = []
+
+	for notebook_uris in uris:
+		notebook_results = []
+
+		for uri in notebook_uris:
+			if num_uris >= MAX_WINDOW_URIS:
+				break
+
+			if uri and uri in seen:
+				continue
+
+			seen.add(uri)
+			notebook_results.append(uri)
+			num_uris += 1
+
+		if notebook_results or not notebook_uris:
+			results.append(notebook_results)
+
+	return results
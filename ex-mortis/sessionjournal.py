@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+#
+# sessionjournal.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+gi.require_version('Gio', '2.0')
+
+import json
+import os
+import os.path
+from gi.repository import GObject, GLib, Gedit, Gio
+from .handlers import connect_handlers, disconnect_handlers
+from .instrument import instrument_methods
+from .settings import write_window_state
+from . import metrics
+from . import log
+
+
+# window states are written to the window settings when a window is tracked,
+# after that changes are only written when flushed:
+#
+# journal - changes are appended to a local log; flushing writes the changed
+#           keys to the window settings and empties the log; flushed every
+#           interval, when the log grows too long and at shutdown
+# periodic - flushed every interval and at shutdown
+# on-quit - flushed at shutdown
+#
+# on startup, the log is replayed on top of the window settings before they
+# are read
+#
+# records are json arrays, one per line:
+#   ["window", window_id] - window settings were fully written, earlier
+#                           records for this window id are stale
+#   ["remove", window_id] - window settings were reset
+#   ["set", window_id, key, value]
+#   ["splice", window_id, notebook_index, start, end, uris] - replace
+#                           uris[notebook_index][start:end] with uris
+#
+# uri changes are recorded as splices of the notebook that changed, so the
+# size of a record does not depend on the number of open tabs
+
+FILENAME = 'session.journal'
+
+# flush early if the log has this many records
+MAX_RECORDS = 2000
+
+
+class ExMortisSessionJournal(GObject.Object):
+
+	__gtype_name__ = 'ExMortisSessionJournal'
+
+	# journal, periodic or on-quit
+	mode = GObject.Property(type=str, default='journal')
+
+	# seconds
+	interval = GObject.Property(type=int, default=300)
+
+
+	def __init__(self, directory=None):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("directory=%s", directory))
+
+		self._directory = directory
+		self._is_persisting = bool(directory)
+		self._file = None
+		self._num_records = 0
+		self._flush_id = None
+		# window id -> (state, window settings)
+		self._windows = {}
+		# window id -> uris as last recorded
+		self._uris = {}
+		# window id -> set of keys changed since the last flush
+		self._pending = {}
+
+		self.connect('notify::interval', self.on_notify_interval)
+
+	def cleanup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		for window_id in list(self._windows.keys()):
+			self.untrack(window_id)
+
+		self.cancel_flush()
+		self.close_file()
+
+	def __len__(self):
+		return self._num_records
+
+
+	# tracking
+
+	def is_tracking(self, window_id):
+		return window_id in self._windows
+
+	def track(self, window_id, state, window_settings):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
+
+		if window_id in self._windows:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Already tracking window id %s", window_id))
+
+			return
+
+		self.append(['window', window_id])
+
+		write_window_state(window_settings, state)
+
+		self._windows[window_id] = (state, window_settings)
+		self._uris[window_id] = state.restore_uris
+
+		connect_handlers(
+			self, state,
+			[
+				'notify',
+				'uris-changed',
+				'notebook-widths-changed'
+			],
+			'state',
+			window_id
+		)
+
+	def untrack(self, window_id):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
+
+		if window_id not in self._windows:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Not tracking window id %s", window_id))
+
+			return
+
+		state, window_settings = self._windows.pop(window_id)
+		del self._uris[window_id]
+		self._pending.pop(window_id, None)
+
+		disconnect_handlers(self, state)
+
+		self.append(['remove', window_id])
+
+	def is_journaling(self):
+		return self.mode == 'journal' and self._is_persisting
+
+	def on_state_notify(self, state, pspec, window_id):
+		self.add_pending(window_id, pspec.name)
+		self.append(['set', window_id, pspec.name, state.get_property(pspec.name)])
+
+	def on_state_uris_changed(self, state, window_id):
+		self.add_pending(window_id, 'uris')
+
+		if not self.is_journaling():
+			self.schedule_flush()
+			return
+
+		uris = state.restore_uris
+		previous_uris = self._uris[window_id]
+
+		self._uris[window_id] = uris
+
+		if len(uris) != len(previous_uris):
+			self.append(['set', window_id, 'uris', uris])
+			return
+
+		for notebook_index, (notebook_uris, previous_notebook_uris) in enumerate(zip(uris, previous_uris)):
+			if notebook_uris != previous_notebook_uris:
+				start, end, inserted = get_splice(previous_notebook_uris, notebook_uris)
+				self.append(['splice', window_id, notebook_index, start, end, inserted])
+
+	def on_state_notebook_widths_changed(self, state, window_id):
+		self.add_pending(window_id, 'notebook-widths')
+		self.append(['set', window_id, 'notebook-widths', state.restore_notebook_widths])
+
+	def add_pending(self, window_id, key):
+		self._pending.setdefault(window_id, set()).add(key)
+
+
+	# log
+
+	def append(self, record):
+		if self.is_journaling():
+			try:
+				if not self._file:
+					os.makedirs(self._directory, exist_ok=True)
+					self._file = open(self.get_path(), 'a', encoding='utf-8')
+
+				self._file.write(encode_record(record))
+				self._file.flush()
+
+			except OSError as e:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Could not write session journal, will write window settings periodically: %s", e))
+
+				self._is_persisting = False
+				self.close_file()
+
+			else:
+				self._num_records += 1
+
+				metrics.increment('journal.records')
+
+				if self._num_records >= MAX_RECORDS:
+					self.flush()
+					return
+
+		if self._pending:
+			self.schedule_flush()
+
+	def flush(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.cancel_flush()
+
+		start_time = metrics.now()
+		pending = self._pending
+
+		self._pending = {}
+
+		for window_id, keys in pending.items():
+			state, window_settings = self._windows[window_id]
+
+			write_window_state(window_settings, state, keys)
+
+			if 'uris' in keys:
+				self._uris[window_id] = state.restore_uris
+
+		# the log can only be emptied once the window settings are written
+		Gio.Settings.sync()
+
+		self.clear()
+
+		# records are only replayed for windows with a window record
+		for window_id in self._windows:
+			self.append(['window', window_id])
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Flushed %s windows", len(pending)))
+
+		metrics.increment('persistence.flushes')
+		metrics.observe_elapsed('persistence.flush', start_time)
+
+	def clear(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.close_file()
+
+		self._num_records = 0
+
+		if not self._directory:
+			return
+
+		try:
+			os.remove(self.get_path())
+		except FileNotFoundError:
+			pass
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not remove session journal: %s", e))
+
+	def replay(self, settings):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self._directory:
+			return
+
+		try:
+			with open(self.get_path(), 'r', encoding='utf-8') as f:
+				records = decode_records(f)
+
+		except FileNotFoundError:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("No session journal"))
+
+			return
+
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not read session journal: %s", e))
+
+			return
+
+		restore_windows = set(settings.restore_windows)
+		values = {}
+
+		# only records after the last window / remove record for each window
+		# id apply to the current window settings
+		for record in records:
+			op, window_id = record[0], record[1]
+
+			if op == 'window':
+				values[window_id] = {}
+				continue
+
+			if op == 'remove':
+				values.pop(window_id, None)
+				continue
+
+			if window_id not in values or window_id not in restore_windows:
+				continue
+
+			window_settings = settings.get_window_settings(window_id)
+
+			if not window_settings:
+				continue
+
+			window_values = values[window_id]
+
+			try:
+				if op == 'set':
+					key, value = record[2], record[3]
+					window_values[key] = value
+
+				elif op == 'splice':
+					notebook_index, start, end, inserted = record[2:6]
+
+					if 'uris' not in window_values:
+						window_values['uris'] = [list(uris) for uris in window_settings['uris']]
+
+					window_values['uris'][notebook_index][start:end] = inserted
+
+			except (IndexError, TypeError, ValueError) as e:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Invalid session journal record for window id %s, ignoring: %s", window_id, e))
+
+		for window_id, window_values in values.items():
+			window_settings = settings.get_window_settings(window_id) if window_id in restore_windows else None
+
+			if not window_settings:
+				continue
+
+			for key, value in window_values.items():
+				try:
+					window_settings[key] = value
+				except (KeyError, TypeError, ValueError) as e:
+					if log.query(log.WARNING):
+						Gedit.debug_plugin_message(log.format("Could not apply session journal value %s for window id %s: %s", key, window_id, e))
+
+		Gio.Settings.sync()
+
+		if log.query(log.MESSAGE):
+			Gedit.debug_plugin_message(log.format("Replayed %s session journal records", len(records)))
+
+		self.clear()
+
+	def get_path(self):
+		return os.path.join(self._directory, FILENAME)
+
+	def close_file(self):
+		if self._file:
+			try:
+				self._file.close()
+			except OSError:
+				pass
+
+			self._file = None
+
+
+	# flush timeout
+
+	def schedule_flush(self):
+		if self._flush_id is None and self.mode != 'on-quit':
+			self._flush_id = GLib.timeout_add_seconds(max(self.interval, 1), self.on_flush_timeout)
+
+	def cancel_flush(self):
+		if self._flush_id is not None:
+			GLib.source_remove(self._flush_id)
+			self._flush_id = None
+
+	def on_flush_timeout(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._flush_id = None
+
+		self.flush()
+
+		return False
+
+	def on_notify_interval(self, journal, pspec):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("interval=%s", self.interval))
+
+		if self._flush_id is not None:
+			self.cancel_flush()
+			self.schedule_flush()
+
+
+def get_splice(previous, current):
+	start = 0
+	end = len(previous)
+	current_end = len(current)
+
+	while start < end and start < current_end and previous[start] == current[start]:
+		start += 1
+
+	while end > start and current_end > start and previous[end - 1] == current[current_end - 1]:
+		end -= 1
+		current_end -= 1
+
+	return start, end, current[start:current_end]
+
+def encode_record(record):
+	return json.dumps(record, separators=(',', ':')) + '\n'
+
+def decode_records(lines):
+	records = []
+
+	for line in lines:
+		try:
+			record = json.loads(line)
+		except ValueError:
+			# the last line may be incomplete if gedit crashed while writing
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Invalid session journal line, ignoring"))
+
+			continue
+
+		if isinstance(record, list) and len(record) >= 2:
+			records.append(record)
+
+	return records
+
+
+# signal handlers and timeout callbacks
+instrument_methods(ExMortisSessionJournal, ('on_',))
@@ -21,15 +21,51 @@
 
 import gi
 gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
 gi.require_version('Gedit', '3.0')
 gi.require_version('Gio', '2.0')
 
+import heapq
 import os.path
-from gi.repository import GObject, Gedit, Gio
+from gi.repository import GObject, GLib, Gedit, Gio
+from .compat import list_properties
+from .handlers import connect_handlers, disconnect_handlers
 from .plugin import data_dir as plugin_data_dir
+from . import metrics
 from . import log
 
 
+# the session and backup session are each stored in a single value, so
+# that they can be read and written at once:
+#   {'version': <uint32>, 'windows': <aa{sv}>, 'screen': <(ii)>}
+# where each window is a window state dict (see ExMortisWindowState.to_dict())
+#
+# windows are saved without empty windows and fitted to the screen (of the
+# given size), so that on startup they only need to be fitted again if the
+# screen size has changed
+#
+# while gedit is running, windows are tracked in per-window settings instead
+# (restore-windows, and relocatable restore-window schemas), so that changes
+# can be written one key at a time; these are read together with the
+# session, which also migrates windows saved by older versions
+
+SESSION_VERSION = 1
+
+SCHEMA_ID = 'com.thingsthemselves.gedit.plugins.ex-mortis'
+
+WINDOW_SCHEMA_ID = 'com.thingsthemselves.gedit.plugins.ex-mortis.restore-window'
+
+WINDOW_ID_PREFIX = 'window'
+
+# the schema source and Gio.Settings objects are shared by every
+# ExMortisSettings (e.g. the app activatable and the preferences dialog);
+# they are created when first used and kept until released
+_schema_source = None
+
+# (schema id, settings path) -> Gio.Settings, or None if the schema is missing
+_settings_cache = {}
+
+
 class ExMortisSettings(GObject.Object):
 
 	__gtype_name__ = 'ExMortisSettings'
@@ -40,45 +76,36 @@ class ExMortisSettings(GObject.Object):
 
 	backup_restore_windows = GObject.Property(type=GObject.GType.from_name('GStrv'), default=[])
 
+	retain_closed_documents_time = GObject.Property(type=int, default=0)
 
-	def __init__(self, is_enabled=True):
-		GObject.Object.__init__(self)
+	retain_closed_documents_size = GObject.Property(type=int, default=16)
 
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("is_enabled=%s", is_enabled))
+	prewarm_window = GObject.Property(type=bool, default=False)
 
-		schemas_directory = os.path.join(plugin_data_dir, 'schemas')
-		default_schema_source = Gio.SettingsSchemaSource.get_default()
+	profile = GObject.Property(type=bool, default=False)
 
-		try:
-			schema_source = Gio.SettingsSchemaSource.new_from_directory(
-				schemas_directory,
-				default_schema_source,
-				False
-			)
+	watchdog_budget = GObject.Property(type=int, default=0)
+
+	trace = GObject.Property(type=bool, default=False)
+
+	persistence_mode = GObject.Property(type=str, default='real-time')
+
+	persistence_interval = GObject.Property(type=int, default=300)
 
-		except:
-			if log.query(log.INFO):
-				Gedit.debug_plugin_message(log.format("Could not load schema source from %s", schemas_directory))
 
-			schema_source = None
+	def __init__(self, is_enabled=True):
+		GObject.Object.__init__(self)
 
-		if not schema_source:
-			schema_source = default_schema_source
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("is_enabled=%s", is_enabled))
 
 		if is_enabled:
-			settings = get_settings(
-				schema_source,
-				'com.thingsthemselves.gedit.plugins.ex-mortis'
-			)
+			settings = get_settings(SCHEMA_ID)
 		else:
 			settings = None
 
 		if settings:
-			try:
-				params = self.list_properties()
-			except AttributeError: # gedit 3.12
-				params = GObject.list_properties(self)
+			params = list_properties(self)
 
 			for param in params:
 				settings.bind(
@@ -87,13 +114,11 @@ class ExMortisSettings(GObject.Object):
 					Gio.SettingsBindFlags.DEFAULT
 				)
 
-		self._schema_source = schema_source
 		self._settings = settings
+		self._window_id_allocator = ExMortisWindowIdAllocator(self.restore_windows)
+		# window id -> Gio.Settings, created when first used
 		self._window_settings = {}
 
-		for window_id in self.restore_windows:
-			self.init_window_settings(window_id)
-
 	def cleanup(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
@@ -101,10 +126,7 @@ class ExMortisSettings(GObject.Object):
 		settings = self._settings
 
 		if settings:
-			try:
-				params = self.list_properties()
-			except AttributeError: # gedit 3.12
-				params = GObject.list_properties(self)
+			params = list_properties(self)
 
 			for param in params:
 				try:
@@ -112,8 +134,12 @@ class ExMortisSettings(GObject.Object):
 				except ValueError: # gedit 3.14
 					pass
 
-		self._schema_source = None
+		for window_settings in self._window_settings.values():
+			if window_settings:
+				disconnect_handlers(self, window_settings)
+
 		self._settings = None
+		self._window_id_allocator = None
 		self._window_settings = None
 
 
@@ -123,110 +149,124 @@ class ExMortisSettings(GObject.Object):
 
 	@property
 	def have_backup(self):
-		return bool(self.backup_restore_windows)
+		if not self._settings:
+			return False
 
+		backup_session = self._settings['backup-session']
 
-	def add_window(self):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format(""))
+		return bool(backup_session.get('windows') or self.backup_restore_windows)
 
-		window_id = self.find_unused_window_id()
 
-		if log.query(log.INFO):
-			Gedit.debug_plugin_message(log.format("Adding window id %s", window_id))
+	# restore-windows is written once per batch of added / removed windows
 
-		self.init_window_settings(window_id)
+	def add_window(self):
+		return self.add_windows(1)[0]
 
-		restore_windows = self.restore_windows
-		restore_windows.append(window_id)
-		self.restore_windows = restore_windows
+	def add_windows(self, num_windows):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("num_windows=%s", num_windows))
 
-		return window_id
+		allocator = self._window_id_allocator
+		window_ids = [allocator.allocate() for i in range(num_windows)]
 
-	def remove_windows(self):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format(""))
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Adding window ids %s", window_ids))
 
-		for window_id in list(self.restore_windows):
-			self.remove_window(window_id)
+		if window_ids:
+			self.restore_windows = self.restore_windows + window_ids
+
+		return window_ids
 
 	def remove_window(self, window_id):
+		self.remove_windows([window_id])
+
+	# removes all windows if window_ids is None
+	def remove_windows(self, window_ids=None):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
+			Gedit.debug_plugin_message(log.format("window_ids=%s", window_ids))
 
-		if window_id not in self._window_settings:
-			if log.query(log.WARNING):
-				Gedit.debug_plugin_message(log.format("Unknown window id %s", window_id))
+		allocator = self._window_id_allocator
+		restore_windows = self.restore_windows
+		removed = set()
 
-			return
+		if window_ids is None:
+			window_ids = restore_windows
 
-		if log.query(log.INFO):
-			Gedit.debug_plugin_message(log.format("Removing window id %s", window_id))
+		for window_id in window_ids:
+			if window_id not in allocator or window_id in removed:
+				if log.query(log.WARNING):
+					Gedit.debug_plugin_message(log.format("Unknown window id %s", window_id))
 
-		self.reset_window_settings(window_id)
+				continue
 
-		restore_windows = self.restore_windows
-		restore_windows.remove(window_id)
-		self.restore_windows = restore_windows
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("Removing window id %s", window_id))
 
-		del self._window_settings[window_id]
+			self.reset_window_settings(window_id)
 
-	def find_unused_window_id(self):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format(""))
+			window_settings = self._window_settings.pop(window_id, None)
 
-		window_id_set = set(self.restore_windows)
-		counter = 0
+			if window_settings:
+				disconnect_handlers(self, window_settings)
 
-		while True:
-			window_id = 'window' + str(counter)
+			release_window_settings(window_id)
 
-			if window_id not in window_id_set:
-				break
+			removed.add(window_id)
 
-			counter += 1
+		if not removed:
+			return
 
-		if log.query(log.INFO):
-			Gedit.debug_plugin_message(log.format("Found unused window id %s", window_id))
+		self.restore_windows = [
+			window_id
+			for window_id in restore_windows
+			if window_id not in removed
+		]
 
-		return window_id
+		for window_id in removed:
+			allocator.release(window_id)
 
-	def init_window_settings(self, window_id):
+	def on_window_settings_changed(self, settings, key, window_id):
 		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
+			Gedit.debug_plugin_message(log.format("window_id=%s, key=%s", window_id, key))
 
-		if window_id in self._window_settings:
-			if log.query(log.WARNING):
-				Gedit.debug_plugin_message(log.format("Already init for window id %s", window_id))
-
-			return
+		metrics.increment('settings.writes')
+		metrics.increment('settings.writes.' + window_id)
 
-		settings = get_window_settings(self._schema_source, window_id)
-		self._window_settings[window_id] = settings
+	# window ids in use by this instance
+	def get_window_ids(self):
+		return list(self._window_id_allocator)
 
 	def get_window_settings(self, window_id):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
 
-		if window_id not in self._window_settings:
+		if window_id in self._window_settings:
+			return self._window_settings[window_id]
+
+		if not self._settings or window_id not in self._window_id_allocator:
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Unknown window id %s", window_id))
 
 			return None
 
-		return self._window_settings[window_id]
+		settings = get_window_settings(window_id)
+		self._window_settings[window_id] = settings
+
+		if settings:
+			connect_handlers(
+				self, settings,
+				['changed'],
+				'window_settings',
+				window_id
+			)
+
+		return settings
 
 	def reset_window_settings(self, window_id):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("window_id=%s", window_id))
 
-		if window_id not in self._window_settings:
-			if log.query(log.WARNING):
-				Gedit.debug_plugin_message(log.format("Unknown window id %s", window_id))
-
-			return
-
-		settings = self._window_settings[window_id]
+		settings = self.get_window_settings(window_id)
 
 		if not settings:
 			if log.query(log.WARNING):
@@ -236,24 +276,24 @@ class ExMortisSettings(GObject.Object):
 
 		reset_settings(settings)
 
-	def save_backup(self):
+	# session
+
+	def load_session(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
-		if not self.can_save:
-			if log.query(log.DEBUG):
-				Gedit.debug_plugin_message(log.format("Not modifying settings"))
+		if not self._settings:
+			return [], None
 
-			return
+		windows, screen = unpack_session(self._settings['session'])
 
-		self.clear_backup()
-
-		schema_source = self._schema_source
-		restore_windows = self.restore_windows
+		# windows tracked when gedit did not quit normally,
+		# or saved by an older version
+		if self.restore_windows:
+			screen = None
 
-		for window_id in restore_windows:
+		for window_id in self.restore_windows:
 			window_settings = self.get_window_settings(window_id)
-			backup_window_settings = get_window_settings(schema_source, window_id, backup=True)
 
 			if not window_settings:
 				if log.query(log.WARNING):
@@ -261,19 +301,25 @@ class ExMortisSettings(GObject.Object):
 
 				continue
 
-			if not backup_window_settings:
-				if log.query(log.WARNING):
-					Gedit.debug_plugin_message(log.format("Could not get backup settings for window id %s", window_id))
+			windows.append(read_window_settings(window_settings))
 
-				continue
+		return windows, screen
 
-			copy_settings(window_settings, backup_window_settings)
+	def save_session(self, windows, screen=None):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s windows, screen=%s", len(windows), screen))
 
-		self.backup_restore_windows = restore_windows
+		if not self.can_save:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Not modifying settings"))
+
+			return
+
+		self._settings['session'] = pack_session(windows, screen)
 
 		Gio.Settings.sync()
 
-	def restore_backup(self):
+	def clear_session(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
@@ -285,10 +331,26 @@ class ExMortisSettings(GObject.Object):
 
 		self.remove_windows()
 
-		schema_source = self._schema_source
+		self._settings.reset('session')
+
+
+	# backup
+
+	def load_backup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self._settings:
+			return [], None
+
+		windows, screen = unpack_session(self._settings['backup-session'])
+
+		# backup saved by an older version
+		if self.backup_restore_windows:
+			screen = None
 
 		for backup_window_id in self.backup_restore_windows:
-			backup_window_settings = get_window_settings(schema_source, backup_window_id, backup=True)
+			backup_window_settings = get_window_settings(backup_window_id, backup=True)
 
 			if not backup_window_settings:
 				if log.query(log.WARNING):
@@ -296,16 +358,25 @@ class ExMortisSettings(GObject.Object):
 
 				continue
 
-			window_id = self.add_window()
-			window_settings = self.get_window_settings(window_id)
+			windows.append(read_window_settings(backup_window_settings))
 
-			if not window_settings:
-				if log.query(log.WARNING):
-					Gedit.debug_plugin_message(log.format("Could not get settings for window id %s", window_id))
+		return windows, screen
 
-				continue
+	def save_backup(self, windows, screen=None):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s windows, screen=%s", len(windows), screen))
 
-			copy_settings(backup_window_settings, window_settings)
+		if not self.can_save:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Not modifying settings"))
+
+			return
+
+		self.clear_backup()
+
+		self._settings['backup-session'] = pack_session(windows, screen)
+
+		Gio.Settings.sync()
 
 	def clear_backup(self):
 		if log.query(log.DEBUG):
@@ -317,48 +388,235 @@ class ExMortisSettings(GObject.Object):
 
 			return
 
-		schema_source = self._schema_source
-
 		for backup_window_id in self.backup_restore_windows:
-			backup_window_settings = get_window_settings(schema_source, backup_window_id, backup=True)
-
-			if not backup_window_settings:
-				if log.query(log.WARNING):
-					Gedit.debug_plugin_message(log.format("Could not get backup settings for window id %s", backup_window_id))
+			backup_window_settings = get_window_settings(backup_window_id, backup=True)
 
-				continue
+			if backup_window_settings:
+				reset_settings(backup_window_settings)
+			elif log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not get backup settings for window id %s", backup_window_id))
 
-			reset_settings(backup_window_settings)
+			release_window_settings(backup_window_id, backup=True)
 
 		self._settings.reset('backup-restore-windows')
+		self._settings.reset('backup-session')
 
 		Gio.Settings.sync()
 
-def get_window_settings(schema_source, window_id, backup=False):
+
+# window ids are 'window0', 'window1', etc.; the lowest free id is reused, so
+# that the relocatable settings paths stay few
+
+class ExMortisWindowIdAllocator(object):
+
+	def __init__(self, window_ids=()):
+		self._used = set()
+		self._free = [] # heap of numbers below self._next, may include used ones
+		self._next = 0
+
+		for window_id in window_ids:
+			self.reserve(window_id)
+
+	def __contains__(self, window_id):
+		return window_id in self._used
+
+	def __iter__(self):
+		return iter(self._used)
+
+	def __len__(self):
+		return len(self._used)
+
+	def allocate(self):
+		free = self._free
+
+		while free:
+			window_id = WINDOW_ID_PREFIX + str(heapq.heappop(free))
+
+			if window_id not in self._used:
+				break
+
+		else:
+			window_id = WINDOW_ID_PREFIX + str(self._next)
+			self._next += 1
+
+		self._used.add(window_id)
+
+		return window_id
+
+	def reserve(self, window_id):
+		self._used.add(window_id)
+
+		number = parse_window_id(window_id)
+
+		if number is None or number < self._next:
+			return
+
+		for i in range(self._next, number):
+			heapq.heappush(self._free, i)
+
+		self._next = number + 1
+
+	def release(self, window_id):
+		self._used.discard(window_id)
+
+		number = parse_window_id(window_id)
+
+		if number is not None and number < self._next:
+			heapq.heappush(self._free, number)
+
+
+def parse_window_id(window_id):
+	number = window_id[len(WINDOW_ID_PREFIX):]
+
+	if not window_id.startswith(WINDOW_ID_PREFIX) or not number.isdigit():
+		return None
+
+	return int(number)
+
+
+# settings cache
+
+def get_schema_source():
+	global _schema_source
+
+	if _schema_source:
+		return _schema_source
+
 	if log.query(log.DEBUG):
-		Gedit.debug_plugin_message(log.format("window_id=%s, backup=%s", window_id, backup))
+		Gedit.debug_plugin_message(log.format(""))
+
+	schemas_directory = os.path.join(plugin_data_dir, 'schemas')
+	default_schema_source = Gio.SettingsSchemaSource.get_default()
+
+	try:
+		schema_source = Gio.SettingsSchemaSource.new_from_directory(
+			schemas_directory,
+			default_schema_source,
+			False
+		)
+
+	except:
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Could not load schema source from %s", schemas_directory))
+
+		schema_source = None
+
+	if not schema_source:
+		schema_source = default_schema_source
+
+	_schema_source = schema_source
+
+	return schema_source
+
+def get_settings(schema_id, settings_path=None):
+	key = (schema_id, settings_path)
+
+	if key in _settings_cache:
+		return _settings_cache[key]
+
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("schema_id=%s, settings_path=%s", schema_id, settings_path))
+
+	schema = get_schema_source().lookup(schema_id, True)
+	settings = Gio.Settings.new_full(schema, None, settings_path) if schema else None
+
+	metrics.increment('settings.created')
+
+	_settings_cache[key] = settings
 
-	schema_id = 'com.thingsthemselves.gedit.plugins.ex-mortis.restore-window'
+	return settings
 
+def release_settings(schema_id, settings_path=None):
+	_settings_cache.pop((schema_id, settings_path), None)
+
+# objects already handed out stay valid; they are just no longer shared
+def release_settings_cache():
+	global _schema_source
+
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("%s settings", len(_settings_cache)))
+
+	_settings_cache.clear()
+	_schema_source = None
+
+def get_window_settings_path(window_id, backup=False):
 	settings_base_path = '/com/thingsthemselves/gedit/plugins/ex-mortis/'
 	settings_dir = 'restore-windows/' if not backup else 'backup-restore-windows/'
-	settings_path = settings_base_path + settings_dir + window_id + '/'
 
-	return get_settings(schema_source, schema_id, settings_path)
+	return settings_base_path + settings_dir + window_id + '/'
 
-def get_settings(schema_source, schema_id, settings_path=None):
+def get_window_settings(window_id, backup=False):
 	if log.query(log.DEBUG):
-		Gedit.debug_plugin_message(log.format("schema_id=%s, settings_path=%s", schema_id, settings_path))
+		Gedit.debug_plugin_message(log.format("window_id=%s, backup=%s", window_id, backup))
+
+	return get_settings(WINDOW_SCHEMA_ID, get_window_settings_path(window_id, backup))
+
+def release_window_settings(window_id, backup=False):
+	release_settings(WINDOW_SCHEMA_ID, get_window_settings_path(window_id, backup))
+
+
+# session values
+
+def write_window_state(window_settings, state, keys=None):
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("keys=%s", keys))
+
+	params = list_properties(state)
+
+	for param in params:
+		if keys is None or param.name in keys:
+			window_settings[param.name] = state.get_property(param.name)
 
-	schema = schema_source.lookup(schema_id, True)
-	return Gio.Settings.new_full(schema, None, settings_path) if schema else None
+	if keys is None or 'uris' in keys:
+		window_settings['uris'] = state.restore_uris
+	if keys is None or 'notebook-widths' in keys:
+		window_settings['notebook-widths'] = state.restore_notebook_widths
 
-def copy_settings(source, destination):
+def read_window_settings(window_settings):
 	if log.query(log.DEBUG):
 		Gedit.debug_plugin_message(log.format(""))
 
-	for key in source.keys():
-		destination[key] = source[key]
+	return {key : window_settings[key] for key in window_settings.keys()}
+
+def pack_session(windows, screen=None):
+	session = {
+		'version': GLib.Variant('u', SESSION_VERSION),
+		'windows': GLib.Variant('aa{sv}', [
+			{
+				key : to_variant(key, value)
+				for key, value in window.items()
+			}
+			for window in windows
+		])
+	}
+
+	if screen:
+		session['screen'] = GLib.Variant('(ii)', tuple(screen))
+
+	return session
+
+def unpack_session(session):
+	version = session.get('version', 0)
+
+	if version > SESSION_VERSION:
+		if log.query(log.WARNING):
+			Gedit.debug_plugin_message(log.format("Session saved by a newer version (%s), some values may be ignored", version))
+
+	screen = session.get('screen')
+
+	return list(session.get('windows', [])), tuple(screen) if screen else None
+
+def to_variant(key, value):
+	if key == 'uris':
+		return GLib.Variant('aas', value)
+	if key == 'notebook-widths':
+		return GLib.Variant('ai', value)
+	if isinstance(value, bool):
+		return GLib.Variant('b', value)
+	if isinstance(value, int):
+		return GLib.Variant('i', value)
+
+	return GLib.Variant('s', value)
 
 def reset_settings(settings):
 	if log.query(log.DEBUG):
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+#
+# tracerecorder.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gdk', '3.0')
+gi.require_version('Gedit', '3.0')
+gi.require_version('Gtk', '3.0')
+
+import gzip
+import json
+import os
+import os.path
+from gi.repository import GObject, GLib, Gdk, Gedit, Gtk
+from .compat import get_tab_uri
+from .plugin import user_cache_dir
+from .weakobjectmap import WeakObjectMap
+from .windowstate import ExMortisWindowState
+from . import instrument
+from . import log
+
+
+# records the calls into the window manager (signal handlers, debounced /
+# idle callbacks, tracking windows, importing / exporting states) into a
+# gzipped trace file in the user cache directory, to be fed to replay.py
+#
+# the first line is a header; each following line is one call:
+#     [milliseconds since start, method name, args, kwargs, window values]
+#
+# objects are written as {"o": id, "t": type name}, where ids are assigned in
+# order of first appearance; window values hold what the window manager reads
+# from the window (size, panels, paneds, notebooks and tabs), and only the
+# values that have changed since the last call for that window
+#
+# enabled with the GEDIT_EX_MORTIS_TRACE environment variable or the trace
+# setting
+
+ENV_VAR = 'GEDIT_EX_MORTIS_TRACE'
+
+TRACES_DIRNAME = 'traces'
+
+TRACE_VERSION = 1
+
+CLASS_NAME = 'ExMortisWindowManager'
+
+RECORDED_PREFIXES = ('on_', 'debounce_', 'idle_')
+
+RECORDED_METHODS = (
+	'track_window',
+	'untrack_window',
+	'set_quitting',
+	'import_window_state',
+	'export_window_state'
+)
+
+NOT_RECORDED_METHODS = (
+	'on_notify_prewarm_window',
+	'on_debounce_target_destroyed'
+)
+
+# calls that only read scalar window values, so notebooks and tabs do not
+# need to be walked
+SCALAR_METHODS = (
+	'on_window_configure_event',
+	'on_window_window_state_event',
+	'on_side_panel_changed',
+	'on_side_panel_notify_visible_child_name',
+	'on_side_panel_notify_visible',
+	'on_bottom_panel_changed',
+	'on_bottom_panel_notify_visible_child_name',
+	'on_bottom_panel_notify_visible',
+	'on_hpaned_notify_position',
+	'on_vpaned_notify_position',
+	'debounce_save_window_size',
+	'debounce_save_side_panel_size',
+	'debounce_save_bottom_panel_size',
+	'set_quitting'
+)
+
+# only the contents of states passed to these are written
+STATE_CONTENT_METHODS = (
+	'import_window_state',
+)
+
+# buffered lines are written when there are this many
+FLUSH_LINES = 1000
+
+
+class ExMortisTraceRecorder(GObject.Object):
+
+	__gtype_name__ = 'ExMortisTraceRecorder'
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._path = None
+		self._lines = None
+		self._ids = None
+		self._next_id = 0
+		self._window_values = None
+		self._start_time = None
+
+	def cleanup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.stop()
+
+
+	# starting / stopping
+
+	def is_started(self):
+		return self._path is not None
+
+	def start(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if self.is_started():
+			return
+
+		filename = 'ex-mortis-%s-%s.trace.gz' % (
+			GLib.DateTime.new_now_local().format('%Y%m%d-%H%M%S'),
+			os.getpid()
+		)
+
+		screen = Gdk.Screen.get_default()
+
+		self._path = os.path.join(user_cache_dir, TRACES_DIRNAME, filename)
+		self._lines = [encode_line({
+			'version': TRACE_VERSION,
+			'screen': [screen.get_width(), screen.get_height()] if screen else None
+		})]
+		self._ids = WeakObjectMap()
+		self._next_id = 0
+		self._window_values = {}
+		self._start_time = GLib.get_monotonic_time()
+
+		instrument.add_observer(self)
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Tracing to %s", self._path))
+
+	def stop(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.is_started():
+			return
+
+		instrument.remove_observer(self)
+
+		self.flush()
+
+		self._ids.clear()
+
+		self._path = None
+		self._lines = None
+		self._ids = None
+		self._window_values = None
+		self._start_time = None
+
+	def flush(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.is_started() or not self._lines:
+			return
+
+		lines = self._lines
+		self._lines = []
+
+		try:
+			os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+			# each flush adds a gzip member, which gzip readers concatenate
+			with gzip.open(self._path, 'at', encoding='utf-8') as f:
+				f.writelines(lines)
+
+		except OSError as e:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Could not write trace %s: %s", self._path, e))
+
+
+	# observer
+
+	def begin(self, name, args, kwargs):
+		class_name, _, method = name.partition('.')
+
+		if class_name != CLASS_NAME or not is_recorded_method(method):
+			return None
+
+		# drop self
+		args = args[1:]
+
+		window = find_window(args)
+		values = {}
+
+		if window:
+			values[str(self.get_id(window))] = self.get_changed_window_values(
+				window,
+				method not in SCALAR_METHODS
+			)
+
+		include_state = method in STATE_CONTENT_METHODS
+
+		self._lines.append(encode_line([
+			(GLib.get_monotonic_time() - self._start_time) // 1000,
+			method,
+			[self.encode_arg(arg, include_state) for arg in args],
+			dict((key, self.encode_arg(value, include_state)) for key, value in kwargs.items()),
+			values
+		]))
+
+		if len(self._lines) >= FLUSH_LINES:
+			self.flush()
+
+		return None
+
+	def end(self, name, token):
+		pass
+
+
+	# encoding
+
+	def get_id(self, obj):
+		if obj is None:
+			return None
+
+		if obj not in self._ids:
+			self._ids[obj] = self._next_id
+			self._next_id += 1
+
+		return self._ids[obj]
+
+	def encode_object(self, obj):
+		return {'o': self.get_id(obj), 't': obj.__gtype__.name}
+
+	def encode_arg(self, arg, include_state=False):
+		if arg is None or isinstance(arg, (bool, int, float, str)):
+			return arg
+
+		if isinstance(arg, GObject.ParamSpec):
+			return {'p': arg.name}
+
+		if isinstance(arg, ExMortisWindowState):
+			result = self.encode_object(arg)
+
+			if include_state:
+				result['s'] = arg.to_dict()
+
+			return result
+
+		if isinstance(arg, GObject.Object):
+			return self.encode_object(arg)
+
+		if hasattr(arg, 'new_window_state'):
+			return {'e': 'window-state', 'ws': int(arg.new_window_state)}
+
+		if isinstance(arg, Gdk.Event) or hasattr(arg, 'width'):
+			return {'e': 'configure', 'w': getattr(arg, 'width', 0), 'h': getattr(arg, 'height', 0)}
+
+		return {'r': repr(arg)}
+
+	def get_changed_window_values(self, window, is_structure):
+		window_id = self.get_id(window)
+		values = self.get_window_values(window, is_structure)
+		prev_values = self._window_values.setdefault(window_id, {})
+
+		changed = dict(
+			(key, value)
+			for key, value in values.items()
+			if prev_values.get(key) != value
+		)
+
+		prev_values.update(changed)
+
+		return changed
+
+	def get_window_values(self, window, is_structure):
+		whole_side_panel = window.get_template_child(Gedit.Window, 'side_panel')
+		whole_bottom_panel = window.get_template_child(Gedit.Window, 'bottom_panel')
+		side_panel = window.get_side_panel()
+		bottom_panel = window.get_bottom_panel()
+		hpaned = window.get_template_child(Gedit.Window, 'hpaned')
+		vpaned = window.get_template_child(Gedit.Window, 'vpaned')
+		multi_notebook = window.get_template_child(Gedit.Window, 'multi_notebook')
+		gdk_window = window.get_window()
+
+		values = {
+			'size': list(window.get_size()),
+			'default-size': list(window.get_default_size()),
+			'window-state': int(gdk_window.get_state()) if gdk_window else None,
+			'side-panel': [
+				self.get_id(whole_side_panel),
+				self.get_id(side_panel),
+				get_panel_page_name(side_panel),
+				whole_side_panel.get_visible()
+			],
+			'bottom-panel': [
+				self.get_id(whole_bottom_panel),
+				self.get_id(bottom_panel),
+				get_panel_page_name(bottom_panel),
+				whole_bottom_panel.get_visible()
+			],
+			'hpaned': [self.get_id(hpaned), hpaned.get_position()],
+			'vpaned': [self.get_id(vpaned), vpaned.get_position(), vpaned.get_allocation().height],
+			'multi-notebook': self.get_id(multi_notebook)
+		}
+
+		if is_structure:
+			notebooks = []
+			notebook_ids = {}
+
+			for document in window.get_documents():
+				tab = Gedit.Tab.get_from_document(document)
+				notebook = tab.get_parent()
+				notebook_id = self.get_id(notebook)
+
+				if notebook_id not in notebook_ids:
+					notebook_ids[notebook_id] = len(notebooks)
+					notebooks.append([
+						notebook_id,
+						self.get_id(notebook.get_parent()),
+						notebook.get_allocation().width,
+						[]
+					])
+
+				notebooks[notebook_ids[notebook_id]][3].append([self.get_id(tab), get_tab_uri(tab)])
+
+			values['notebooks'] = notebooks
+			values['paneds'] = [
+				[self.get_id(paned), paned.get_position(), self.get_id(paned.get_child2())]
+				for paned in find_paneds(multi_notebook)
+			]
+			values['active-tab'] = self.get_id(window.get_active_tab())
+
+		return values
+
+
+def is_recorded_method(method):
+	if method in NOT_RECORDED_METHODS:
+		return False
+
+	return method in RECORDED_METHODS or method.startswith(RECORDED_PREFIXES)
+
+def is_tracing_requested(settings):
+	return bool(os.environ.get(ENV_VAR)) or settings.trace
+
+def encode_line(value):
+	return json.dumps(value, separators=(',', ':')) + '\n'
+
+def find_window(args):
+	for arg in args:
+		if isinstance(arg, Gedit.Window):
+			return arg
+
+	return None
+
+def get_panel_page_name(panel):
+	try:
+		return panel.get_active_item_name()
+	except AttributeError: # gedit 45 / 47
+		return panel.get_visible_child_name()
+
+def find_paneds(root):
+	stack = root.get_children()
+	results = []
+
+	while stack:
+		widget = stack.pop()
+
+		if isinstance(widget, Gtk.Paned):
+			results.append(widget)
+			stack.extend(widget.get_children())
+
+	return results
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# watchdog.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+gi.require_version('GLib', '2.0')
+gi.require_version('Gedit', '3.0')
+
+from gi.repository import GObject, GLib, Gedit
+from . import instrument
+from . import metrics
+from . import log
+
+
+# logs instrumented calls (signal handlers, debounced / idle callbacks) that
+# take longer than the budget, along with the number of tabs in the window
+# they were called for
+#
+# while windows are being restored, a heartbeat also measures how late the
+# main loop runs a short timeout, which catches stalls outside of our own
+# handlers (e.g. gedit loading documents)
+
+HEARTBEAT_INTERVAL = 10
+
+# how long to keep the heartbeat running after restoring starts, as
+# documents continue to load after restore_windows() returns
+HEARTBEAT_DURATION = 10000
+
+
+class ExMortisWatchdog(GObject.Object):
+
+	__gtype_name__ = 'ExMortisWatchdog'
+
+	# milliseconds, 0 to disable
+	budget = GObject.Property(type=int, default=0)
+
+
+	def __init__(self):
+		GObject.Object.__init__(self)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._is_observing = False
+		self._heartbeat_id = None
+		self._heartbeat_time = None
+		self._heartbeat_end_time = None
+
+		self.connect('notify::budget', self.on_notify_budget)
+
+	def cleanup(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.stop_heartbeat()
+		self.update_observing(False)
+
+
+	def is_enabled(self):
+		return self.budget > 0
+
+	def update_observing(self, is_enabled):
+		if is_enabled == self._is_observing:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("is_enabled=%s", is_enabled))
+
+		if is_enabled:
+			instrument.add_observer(self)
+		else:
+			instrument.remove_observer(self)
+
+		self._is_observing = is_enabled
+
+	def on_notify_budget(self, watchdog, pspec):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("budget=%s", self.budget))
+
+		self.update_observing(self.is_enabled())
+
+		if not self.is_enabled():
+			self.stop_heartbeat()
+
+
+	# observer
+
+	def begin(self, name, args, kwargs):
+		return (GLib.get_monotonic_time(), args)
+
+	def end(self, name, token):
+		start_time, args = token
+		elapsed = (GLib.get_monotonic_time() - start_time) / 1000
+
+		if elapsed <= self.budget:
+			return
+
+		metrics.increment('watchdog.slow-calls')
+
+		if log.query(log.WARNING):
+			Gedit.debug_plugin_message(log.format(
+				"%s took %.1f ms (budget %s ms), window has %s tabs",
+				name, elapsed, self.budget, get_num_tabs(args)
+			))
+
+
+	# heartbeat
+
+	def start_heartbeat(self, duration=HEARTBEAT_DURATION):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("duration=%s", duration))
+
+		if not self.is_enabled():
+			return
+
+		now = GLib.get_monotonic_time()
+
+		self._heartbeat_end_time = now + duration * 1000
+
+		if self._heartbeat_id is not None:
+			return
+
+		self._heartbeat_time = now
+		self._heartbeat_id = GLib.timeout_add(HEARTBEAT_INTERVAL, self.on_heartbeat)
+
+	def stop_heartbeat(self):
+		if self._heartbeat_id is None:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		GLib.source_remove(self._heartbeat_id)
+
+		self._heartbeat_id = None
+		self._heartbeat_time = None
+		self._heartbeat_end_time = None
+
+	def on_heartbeat(self):
+		now = GLib.get_monotonic_time()
+		latency = (now - self._heartbeat_time) / 1000 - HEARTBEAT_INTERVAL
+
+		metrics.observe('watchdog.heartbeat-latency', max(latency, 0))
+
+		if latency > self.budget:
+			if log.query(log.WARNING):
+				Gedit.debug_plugin_message(log.format("Main loop stalled for %.1f ms", latency))
+
+		if now >= self._heartbeat_end_time:
+			self._heartbeat_id = None
+			self._heartbeat_time = None
+			self._heartbeat_end_time = None
+
+			return False
+
+		self._heartbeat_time = now
+
+		return True
+
+
+# number of tabs in the first window (or the window of the first tab) in args
+def get_num_tabs(args):
+	for arg in args:
+		if isinstance(arg, Gedit.Window):
+			return len(arg.get_documents())
+
+		if isinstance(arg, Gedit.Tab):
+			window = arg.get_toplevel()
+
+			if isinstance(window, Gedit.Window):
+				return len(window.get_documents())
+
+	return None
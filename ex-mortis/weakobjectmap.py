@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# weakobjectmap.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('GObject', '2.0')
+
+import itertools
+import weakref
+from gi.repository import GObject
+
+
+# a dict-like map with GObject keys, that does not keep its keys alive
+#
+# an entry is removed when its key is finalized, or if use_destroy is true and
+# the key has a destroy signal, when the key is destroyed; on_remove is called
+# with the key and value of entries removed this way (the key may be None if
+# it has already been finalized)
+#
+# each key has a single GObject weak ref, shared by every map that holds it
+# (see _keys below), so copying a map does not add weak refs, and maps are
+# only held weakly, so a map that is dropped without being cleared releases
+# its keys when it is collected
+
+class WeakObjectMap(object):
+
+	def __init__(self, on_remove=None, use_destroy=False):
+		self._id = next(_map_ids)
+		# key address -> [value, destroy handler id]
+		self._entries = {}
+		self._on_remove = on_remove
+		self._use_destroy = use_destroy
+
+		weakref.finalize(self, _release_keys, self._id, self._entries)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __bool__(self):
+		return bool(self._entries)
+
+	def __contains__(self, key):
+		return key is not None and hash(key) in self._entries
+
+	def __getitem__(self, key):
+		if key is None or hash(key) not in self._entries:
+			raise KeyError(key)
+		return self._entries[hash(key)][0]
+
+	def __setitem__(self, key, value):
+		address = hash(key)
+
+		if address in self._entries:
+			self._entries[address][0] = value
+			return
+
+		destroy_id = None
+
+		if self._use_destroy and GObject.signal_lookup('destroy', key.__gtype__):
+			destroy_id = key.connect('destroy', self._on_key_destroy, address)
+
+		_add_key(key, self)
+
+		self._entries[address] = [value, destroy_id]
+
+	def __delitem__(self, key):
+		if key not in self:
+			raise KeyError(key)
+		self.pop(key)
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def pop(self, key, *args):
+		if key not in self:
+			if args:
+				return args[0]
+			raise KeyError(key)
+		address = hash(key)
+		value, destroy_id = self._entries.pop(address)
+		if destroy_id is not None:
+			key.disconnect(destroy_id)
+		_discard_key(address, self._id)
+		return value
+
+	def keys(self):
+		return [key for key, value in self.items()]
+
+	def values(self):
+		return [value for key, value in self.items()]
+
+	def items(self):
+		results = []
+		for address, entry in list(self._entries.items()):
+			key = _get_key(address)
+			if key is not None:
+				results.append((key, entry[0]))
+		return results
+
+	# only shares the keys' weak refs; destroy handlers are connected again
+	def copy(self):
+		clone = self.__class__(self._on_remove, self._use_destroy)
+		clone_ref = weakref.ref(clone)
+
+		for address, entry in self._entries.items():
+			key = _get_key(address)
+			if key is None:
+				continue
+			destroy_id = None
+			if entry[1] is not None:
+				destroy_id = key.connect('destroy', clone._on_key_destroy, address)
+			_keys[address][1][clone._id] = clone_ref
+			clone._entries[address] = [entry[0], destroy_id]
+
+		return clone
+
+	def clear(self):
+		entries = dict(self._entries)
+		self._entries.clear()
+		for address, (value, destroy_id) in entries.items():
+			if destroy_id is not None:
+				key = _get_key(address)
+				if key is not None:
+					key.disconnect(destroy_id)
+			_discard_key(address, self._id)
+
+	def _remove(self, address, key):
+		entry = self._entries.pop(address, None)
+		if not entry:
+			return
+		if key is not None:
+			if entry[1] is not None:
+				key.disconnect(entry[1])
+			_discard_key(address, self._id)
+		if self._on_remove:
+			self._on_remove(key, entry[0])
+
+	def _on_key_destroy(self, key, address):
+		self._remove(address, key)
+
+
+_map_ids = itertools.count()
+
+# key address -> [GObject weak ref, {map id: weakref to map}]
+_keys = {}
+
+def _get_key(address):
+	entry = _keys.get(address)
+	return entry[0]() if entry else None
+
+def _add_key(key, wmap):
+	address = hash(key)
+	entry = _keys.get(address)
+
+	if not entry:
+		entry = [key.weak_ref(_on_key_finalized, address), {}]
+		_keys[address] = entry
+
+	entry[1][wmap._id] = weakref.ref(wmap)
+
+def _discard_key(address, map_id):
+	entry = _keys.get(address)
+	if not entry:
+		return
+
+	entry[1].pop(map_id, None)
+
+	if not entry[1]:
+		del _keys[address]
+		if entry[0]() is not None:
+			entry[0].unref()
+
+def _release_keys(map_id, entries):
+	for address in list(entries.keys()):
+		_discard_key(address, map_id)
+	entries.clear()
+
+def _on_key_finalized(address):
+	entry = _keys.pop(address, None)
+	if not entry:
+		return
+
+	for map_ref in list(entry[1].values()):
+		wmap = map_ref()
+		if wmap is not None:
+			wmap._remove(address, None)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+#
+# windowdiff.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+import gi
+gi.require_version('Gedit', '3.0')
+
+from bisect import bisect_left
+from gi.repository import Gedit
+from . import log
+
+
+# diff_window_states() compares the state of a live window (current) with a
+# target state and returns the operations needed to bring the window to the
+# target state, in the order they should be applied; patch_window() (in
+# windowpatch.py) applies them to the window
+#
+# planning only reads window states, never windows or other widgets, so it
+# can be run (and timed) without a display
+#
+# operations are plain tuples:
+#
+# ('set-geometry', width, height, maximized, fullscreen, is_default_size)
+# ('set-side-panel-page-name', page_name)
+# ('set-side-panel-visible', visible)
+# ('set-bottom-panel-page-name', page_name)
+# ('set-bottom-panel-visible', visible)
+# ('show',)
+# ('set-side-panel-size', size)
+# ('set-bottom-panel-size', size)
+# ('close-tab', uri)
+# ('new-notebook',)
+# ('open-uris', notebook_index, uris)
+# ('move-tab', notebook_index, uri, anchor_uri, is_after)
+# ('set-active-uri', uri)
+# ('set-notebook-width', notebook_index, width)
+#
+# notebook indexes count from the first notebook of the window; new notebooks
+# are added after the last notebook
+#
+# if current is None, nothing is known about the window and every operation is
+# included, with uris opened after the existing tabs of the last notebook
+#
+# gedit has no way to move a tab to another notebook, so a target uri that is
+# open in another notebook of the window is left where it is
+#
+# uris in skip_uris (e.g. open in other windows) are treated as if they were
+# not in the target state
+
+def diff_window_states(current, target, is_new_window=False, close_extra=False, skip_uris=None):
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("is_new_window=%s, close_extra=%s", is_new_window, close_extra))
+
+	if not skip_uris:
+		skip_uris = frozenset()
+
+	ops = []
+
+	diff_geometry(ops, current, target, is_new_window)
+	diff_panels(ops, current, target)
+
+	if is_new_window:
+		ops.append(('show',))
+
+	diff_panel_sizes(ops, current, target)
+
+	num_ops = len(ops)
+	notebook_indexes = diff_uris(ops, current, target, close_extra, skip_uris)
+
+	# opening, closing and moving tabs can change the active tab
+	is_tabs_changed = len(ops) > num_ops
+	active_uri = target.active_uri
+
+	if active_uri and active_uri not in skip_uris and (is_tabs_changed or not current or current.active_uri != active_uri):
+		ops.append(('set-active-uri', active_uri))
+
+	diff_notebook_widths(ops, current, target, notebook_indexes)
+
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("ops=%s", ops))
+
+	return ops
+
+def diff_geometry(ops, current, target, is_new_window):
+	names = ['width', 'height', 'maximized', 'fullscreen']
+
+	if is_new_window or not current or any(current.get_property(name) != target.get_property(name) for name in names):
+		ops.append((
+			'set-geometry',
+			target.width, target.height,
+			target.maximized, target.fullscreen,
+			is_new_window
+		))
+
+def diff_panels(ops, current, target):
+	for panel in ['side-panel', 'bottom-panel']:
+		page_name = target.get_property(panel + '-page-name')
+
+		if page_name and (not current or current.get_property(panel + '-page-name') != page_name):
+			ops.append(('set-' + panel + '-page-name', page_name))
+
+		visible = target.get_property(panel + '-visible')
+
+		if not current or current.get_property(panel + '-visible') != visible:
+			ops.append(('set-' + panel + '-visible', visible))
+
+def diff_panel_sizes(ops, current, target):
+	for panel in ['side-panel', 'bottom-panel']:
+		size = target.get_property(panel + '-size')
+
+		if not current or current.get_property(panel + '-size') != size:
+			ops.append(('set-' + panel + '-size', size))
+
+# returns the notebook index of each target notebook, or None if the target
+# notebook was not created
+def diff_uris(ops, current, target, close_extra, skip_uris):
+	target_uris = target.restore_uris
+
+	if skip_uris:
+		target_uris = [
+			[uri for uri in notebook_uris if uri not in skip_uris]
+			for notebook_uris in target_uris
+		]
+
+	# a window without notebooks (e.g. a new window that has not added its
+	# first tab yet) still has a notebook to open the first uris in
+	if not current or not current.uris:
+		# without the current state, notebooks are counted from the end of
+		# the window; notebooks left empty by skip_uris are not created
+		created = [i for i, notebook_uris in enumerate(target_uris) if notebook_uris]
+		notebook_indexes = [None] * len(target_uris)
+
+		for j, i in enumerate(created):
+			if j > 0:
+				ops.append(('new-notebook',))
+
+			ops.append(('open-uris', -1, target_uris[i]))
+			notebook_indexes[i] = j - len(created)
+
+		return notebook_indexes
+
+	current_uris = current.uris
+	target_uri_set = set(uri for notebook_uris in target_uris for uri in notebook_uris)
+
+	# uri -> current notebook index
+	open_uris = {}
+
+	for notebook_index, notebook_uris in enumerate(current_uris):
+		for uri in notebook_uris:
+			if uri:
+				open_uris.setdefault(uri, notebook_index)
+
+	if close_extra:
+		for uri, notebook_index in open_uris.items():
+			if uri not in target_uri_set:
+				ops.append(('close-tab', uri))
+
+	num_notebooks = len(current_uris)
+	notebook_indexes = []
+	moves = []
+
+	for i, notebook_uris in enumerate(target_uris):
+		notebook_uris = unique(notebook_uris)
+		notebook_uri_set = set(notebook_uris)
+		to_open = [uri for uri in notebook_uris if uri not in open_uris]
+
+		if i < len(current_uris):
+			notebook_index = i
+			existing = unique(
+				uri
+				for uri in current_uris[i]
+				if uri in notebook_uri_set and open_uris.get(uri) == i
+			)
+
+		elif to_open:
+			ops.append(('new-notebook',))
+			notebook_index = num_notebooks
+			num_notebooks += 1
+			existing = []
+
+		else:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("All uris of target notebook %s are open in other notebooks", i))
+
+			notebook_indexes.append(None)
+			continue
+
+		if to_open:
+			ops.append(('open-uris', notebook_index, to_open))
+
+			for uri in to_open:
+				open_uris[uri] = notebook_index
+
+		in_notebook = set(existing)
+		in_notebook.update(to_open)
+
+		desired = [uri for uri in notebook_uris if uri in in_notebook]
+		moves.extend(diff_tab_order(notebook_index, existing + to_open, desired))
+
+		notebook_indexes.append(notebook_index)
+
+	ops.extend(moves)
+
+	return notebook_indexes
+
+# moves the fewest tabs needed to put the tabs in order: tabs in a longest
+# increasing subsequence (of their positions in the desired order) stay put
+def diff_tab_order(notebook_index, uris, desired):
+	positions = {uri: i for i, uri in enumerate(uris)}
+	keep = set(longest_increasing_subsequence([positions[uri] for uri in desired]))
+	moves = []
+
+	for i, uri in enumerate(desired):
+		if positions[uri] in keep:
+			continue
+
+		if i > 0:
+			moves.append(('move-tab', notebook_index, uri, desired[i - 1], True))
+		elif len(desired) > 1:
+			moves.append(('move-tab', notebook_index, uri, desired[1], False))
+
+	return moves
+
+def diff_notebook_widths(ops, current, target, notebook_indexes):
+	notebook_widths = target.restore_notebook_widths
+	current_notebook_widths = current.notebook_widths if current else []
+
+	if len(notebook_widths) < 2:
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("Have %s notebook widths, not enough to apply", len(notebook_widths)))
+
+		return
+
+	# we won't set the width of the last notebook
+	for i, width in enumerate(notebook_widths[:-1]):
+		notebook_index = notebook_indexes[i] if i < len(notebook_indexes) else None
+
+		if notebook_index is None:
+			continue
+
+		if current and notebook_index < len(current_notebook_widths) and current_notebook_widths[notebook_index] == width:
+			continue
+
+		ops.append(('set-notebook-width', notebook_index, width))
+
+
+# helpers
+
+def unique(values):
+	seen = set()
+	results = []
+
+	for value in values:
+		if value not in seen:
+			seen.add(value)
+			results.append(value)
+
+	return results
+
+# returns the values in a longest strictly increasing subsequence
+def longest_increasing_subsequence(values):
+	tails = [] # smallest tail value of increasing subsequences of each length
+	tail_indexes = []
+	prev_indexes = [None] * len(values)
+
+	for i, value in enumerate(values):
+		length = bisect_left(tails, value)
+
+		if length == len(tails):
+			tails.append(value)
+			tail_indexes.append(i)
+		else:
+			tails[length] = value
+			tail_indexes[length] = i
+
+		prev_indexes[i] = tail_indexes[length - 1] if length > 0 else None
+
+	results = []
+	i = tail_indexes[-1] if tail_indexes else None
+
+	while i is not None:
+		results.append(values[i])
+		i = prev_indexes[i]
+
+	results.reverse()
+
+	return results
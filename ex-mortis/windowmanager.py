@@ -27,8 +27,13 @@ gi.require_version('Gedit', '3.0')
 gi.require_version('Gtk', '3.0')
 
 from gi.repository import GObject, GLib, Gdk, Gedit, Gtk
+from .compat import HAS_WINDOW_TABS_REORDERED, get_tab_uri
+from .handlers import connect_handlers, disconnect_handlers, disconnect_handler_group, handler_stats
+from .instrument import instrument_methods
+from .utils import debug_str
+from .weakobjectmap import WeakObjectMap
 from .windowstate import ExMortisWindowState
-from .utils import connect_handlers, disconnect_handlers
+from . import metrics
 from . import log
 
 
@@ -36,6 +41,8 @@ class ExMortisWindowManager(GObject.Object):
 
 	__gtype_name__ = 'ExMortisWindowManager'
 
+	prewarm_window = GObject.Property(type=bool, default=False)
+
 
 	def __init__(self, app):
 		GObject.Object.__init__(self)
@@ -44,19 +51,51 @@ class ExMortisWindowManager(GObject.Object):
 			Gedit.debug_plugin_message(log.format(""))
 
 		self._app = app
-		self._windows = {}
-		self._debounce_ids = {}
+		self._windows = WeakObjectMap()
+		self._debounce_ids = WeakObjectMap(self.on_debounce_target_destroyed, use_destroy=True)
+		# uri -> {tab: window}
+		self._uri_index = {}
+		# tab -> uri
+		self._tab_uris = {}
+		# notebook -> the paned it is directly in
+		self._notebook_paneds = WeakObjectMap()
+		# tracked paned -> (window, set of notebooks directly in the paned)
+		self._paned_notebooks = WeakObjectMap()
+		self._spare_window = None
+		self._spare_window_id = None
+		self._is_creating_spare_window = False
+		self._is_quitting = False
+		self._stale_windows = set()
+		self._stale_windows_id = None
+
+		self.connect('notify::prewarm-window', self.on_notify_prewarm_window)
 
 	def cleanup(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
+		self.discard_spare_window()
+		self.cancel_update_stale_windows()
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Tracked objects: %s", self.get_debug_report()))
+
 		for window in list(self._windows.keys()):
 			self.untrack_window(window)
 
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Handler stats: %s", handler_stats(self)))
+
+		self._debounce_ids.clear()
+
 		self._app = None
 		self._windows = None
 		self._debounce_ids = None
+		self._uri_index = None
+		self._tab_uris = None
+		self._notebook_paneds = None
+		self._paned_notebooks = None
+		self._stale_windows = None
 
 
 	# signals
@@ -120,14 +159,16 @@ class ExMortisWindowManager(GObject.Object):
 				'window-state-event'
 			],
 			'window',
-			state
+			state,
+			group=window
 		)
-		if GObject.signal_lookup('tabs-reordered', window) > 0: # removed in gedit 47
+		if HAS_WINDOW_TABS_REORDERED:
 			connect_handlers(
 				self, window,
 				['tabs-reordered'],
 				'window',
-				state
+				state,
+				group=window
 			)
 		connect_handlers(
 			self, multi_notebook,
@@ -136,20 +177,23 @@ class ExMortisWindowManager(GObject.Object):
 				'notebook-removed'
 			],
 			'multi_notebook',
-			window, state
+			window, state,
+			group=window
 		)
 		if side_panel is not whole_side_panel:
 			connect_handlers(
 				self, whole_side_panel,
 				['notify::visible'],
 				'side_panel',
-				window, state
+				window, state,
+				group=window
 			)
 			connect_handlers(
 				self, side_panel,
 				['changed'],
 				'side_panel',
-				window, state
+				window, state,
+				group=window
 			)
 		else: # gedit 45
 			connect_handlers(
@@ -159,20 +203,23 @@ class ExMortisWindowManager(GObject.Object):
 					'notify::visible'
 				],
 				'side_panel',
-				window, state
+				window, state,
+				group=window
 			)
 		if bottom_panel is not whole_bottom_panel:
 			connect_handlers(
 				self, whole_bottom_panel,
 				['notify::visible'],
 				'bottom_panel',
-				window, state
+				window, state,
+				group=window
 			)
 			connect_handlers(
 				self, bottom_panel,
 				['changed'],
 				'bottom_panel',
-				window, state
+				window, state,
+				group=window
 			)
 		else: # gedit 47
 			connect_handlers(
@@ -182,19 +229,22 @@ class ExMortisWindowManager(GObject.Object):
 					'notify::visible'
 				],
 				'bottom_panel',
-				window, state
+				window, state,
+				group=window
 			)
 		connect_handlers(
 			self, hpaned,
 			['notify::position'],
 			'hpaned',
-			window, state
+			window, state,
+			group=window
 		)
 		connect_handlers(
 			self, vpaned,
 			['notify::position'],
 			'vpaned',
-			window, state
+			window, state,
+			group=window
 		)
 
 		self._windows[window] = (
@@ -210,11 +260,17 @@ class ExMortisWindowManager(GObject.Object):
 			}
 		)
 
-		for paned in self.find_paneds(multi_notebook):
-			self.track_paned(window, paned, state, multi_notebook)
+		notebooks = set()
 
 		for document in window.get_documents():
-			self.track_tab(window, Gedit.Tab.get_from_document(document), state)
+			tab = Gedit.Tab.get_from_document(document)
+			notebook = tab.get_parent()
+
+			if notebook not in notebooks:
+				notebooks.add(notebook)
+				self.index_notebook(window, notebook, state, multi_notebook)
+
+			self.track_tab(window, tab, state)
 
 	def untrack_window(self, window):
 		if log.query(log.DEBUG):
@@ -234,22 +290,22 @@ class ExMortisWindowManager(GObject.Object):
 		for document in window.get_documents():
 			self.untrack_tab(window, Gedit.Tab.get_from_document(document), state)
 
-		for paned in self.find_paneds(multi_notebook):
-			self.untrack_paned(window, paned, state, multi_notebook)
+		self._stale_windows.discard(window)
 
 		self.cancel_debounce(window)
 		self.cancel_debounce(multi_notebook)
 		self.cancel_debounce(hpaned)
 		self.cancel_debounce(vpaned)
 
-		disconnect_handlers(self, window)
-		disconnect_handlers(self, multi_notebook)
-		disconnect_handlers(self, widgets['whole_side_panel'])
-		disconnect_handlers(self, widgets['whole_bottom_panel'])
-		disconnect_handlers(self, widgets['side_panel'])
-		disconnect_handlers(self, widgets['bottom_panel'])
-		disconnect_handlers(self, hpaned)
-		disconnect_handlers(self, vpaned)
+		for paned, (paned_window, notebooks) in list(self._paned_notebooks.items()):
+			if paned_window is window:
+				for notebook in notebooks:
+					self._notebook_paneds.pop(notebook, None)
+
+				self._paned_notebooks.pop(paned)
+
+		# also disconnects paneds, whatever state the window's widgets are in
+		disconnect_handler_group(self, window)
 
 		del self._windows[window]
 
@@ -257,19 +313,83 @@ class ExMortisWindowManager(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, paned))
 
+		if paned in self._paned_notebooks:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Already tracking %s", paned))
+
+			return
+
+		self._paned_notebooks[paned] = (window, set())
+
 		connect_handlers(
 			self, paned,
 			['notify::position'],
 			'paned',
-			window, state, multi_notebook
+			window, state, multi_notebook,
+			group=window
 		)
 
 	def untrack_paned(self, window, paned, state, multi_notebook):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, paned))
 
+		self._paned_notebooks.pop(paned, None)
+
+		# does nothing if the paned has already been destroyed
 		disconnect_handlers(self, paned)
 
+	# notebooks are in nested paneds (one per notebook after the first), each
+	# notebook is indexed with the paned it is directly in, and that paned and
+	# the paneds around it are tracked
+	def index_notebook(self, window, notebook, state, multi_notebook):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, %s", window, notebook))
+
+		parent = notebook.get_parent()
+
+		if not isinstance(parent, Gtk.Paned):
+			return
+
+		# the paneds around a tracked paned are already tracked
+		paned = parent
+
+		while isinstance(paned, Gtk.Paned) and paned not in self._paned_notebooks:
+			self.track_paned(window, paned, state, multi_notebook)
+			paned = paned.get_parent()
+
+		self._notebook_paneds[notebook] = parent
+		self._paned_notebooks[parent][1].add(notebook)
+
+	# gedit removes the paned a notebook was in together with the notebook,
+	# and moves the other child of the paned into the paned's parent
+	def unindex_notebook(self, window, notebook, state, multi_notebook):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, %s", window, notebook))
+
+		paned = self._notebook_paneds.pop(notebook, None)
+
+		if paned is None:
+			return
+
+		paned_window, siblings = self._paned_notebooks.get(paned, (window, set()))
+		siblings.discard(notebook)
+
+		self.untrack_paned(window, paned, state, multi_notebook)
+
+		for sibling in siblings:
+			self.reindex_notebook(window, sibling, state, multi_notebook)
+
+	def reindex_notebook(self, window, notebook, state, multi_notebook):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, %s", window, notebook))
+
+		paned = self._notebook_paneds.pop(notebook, None)
+
+		if paned in self._paned_notebooks:
+			self._paned_notebooks[paned][1].discard(notebook)
+
+		self.index_notebook(window, notebook, state, multi_notebook)
+
 	def track_tab(self, window, tab, state):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, tab))
@@ -278,30 +398,19 @@ class ExMortisWindowManager(GObject.Object):
 			self, tab,
 			['notify::name'],
 			'tab',
-			window, state
+			window, state,
+			group=window
 		)
 
+		self.index_tab(window, tab)
+
 	def untrack_tab(self, window, tab, state):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, tab))
 
 		disconnect_handlers(self, tab)
 
-	def find_paneds(self, root):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", root))
-
-		stack = root.get_children()
-		results = []
-
-		while stack:
-			widget = stack.pop()
-
-			if isinstance(widget, Gtk.Paned):
-				results.append(widget)
-				stack.extend(widget.get_children())
-
-		return results
+		self.unindex_tab(tab)
 
 
 	# window state
@@ -335,7 +444,7 @@ class ExMortisWindowManager(GObject.Object):
 		if not state:
 			return None
 
-		export_state = ExMortisWindowState.clone(state)
+		export_state = ExMortisWindowState.snapshot(state)
 
 		if forget_notebooks:
 			export_state.forget_notebooks()
@@ -345,7 +454,7 @@ class ExMortisWindowManager(GObject.Object):
 
 		return export_state
 
-	def import_window_state(self, window, import_state, is_new_window=False):
+	def import_window_state(self, window, import_state, is_new_window=False, retained_documents=None):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, is_new_window=%s", window, is_new_window))
 
@@ -354,7 +463,12 @@ class ExMortisWindowManager(GObject.Object):
 		if not state:
 			return
 
-		import_state.apply_window(window, is_new_window)
+		skip_uris = self.find_duplicate_uris(import_state.restore_uris, window)
+
+		if skip_uris and log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Skipping %s uris open in other windows", len(skip_uris)))
+
+		import_state.apply_window(window, is_new_window, retained_documents, current=state, skip_uris=skip_uris)
 
 	def save_to_window_state(self, window):
 		if log.query(log.DEBUG):
@@ -374,27 +488,288 @@ class ExMortisWindowManager(GObject.Object):
 		if state:
 			state.apply_window(window)
 
-	def open_new_window_with_window_state(self, state):
+	def open_new_window_with_window_state(self, state, retained_documents=None):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
-		window = self._app.create_window()
+		existing = self.find_open_window(state)
+
+		if existing:
+			if log.query(log.INFO):
+				Gedit.debug_plugin_message(log.format("All uris already open, presenting %s", existing))
+
+			existing.present()
 
-		self.import_window_state(window, state, is_new_window=True)
+			return existing
+
+		window = self.take_spare_window()
+
+		if not window:
+			window = self._app.create_window()
+
+		self.import_window_state(window, state, is_new_window=True, retained_documents=retained_documents)
 
 		window.present()
 
 		return window
 
 
+	# uri index
+
+	# every tracked tab, indexed by uri, so that we know which windows already
+	# have a file open without going through each window's documents
+
+	def index_tab(self, window, tab):
+		uri = get_tab_uri(tab)
+		prev_uri = self._tab_uris.get(tab)
+
+		if uri == prev_uri:
+			return
+
+		if prev_uri is not None:
+			self.unindex_tab(tab)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, %s, uri=%s", window, tab, uri))
+
+		self._tab_uris[tab] = uri
+
+		if uri:
+			self._uri_index.setdefault(uri, {})[tab] = window
+
+	def unindex_tab(self, tab):
+		if tab not in self._tab_uris:
+			return
+
+		uri = self._tab_uris.pop(tab)
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s, uri=%s", tab, uri))
+
+		if uri in self._uri_index:
+			entries = self._uri_index[uri]
+			entries.pop(tab, None)
+
+			if not entries:
+				del self._uri_index[uri]
+
+	# returns a list of (window, notebook, tab)
+	def find_uri(self, uri, exclude_window=None):
+		entries = self._uri_index.get(uri, {})
+
+		return [
+			(window, tab.get_parent(), tab)
+			for tab, window in entries.items()
+			if window is not exclude_window
+		]
+
+	def find_duplicate_uris(self, uris, window):
+		return set(
+			uri
+			for notebook_uris in uris
+			for uri in notebook_uris
+			if self.find_uri(uri, window)
+		)
+
+	# returns the window with the state's active uri, if every uri of the state
+	# is open in some window
+	def find_open_window(self, state):
+		uris = state.restore_uris
+		uri_set = set(uri for notebook_uris in uris for uri in notebook_uris)
+
+		if not uri_set or self.find_duplicate_uris(uris, None) != uri_set:
+			return None
+
+		results = self.find_uri(state.active_uri) or self.find_uri(uris[0][0])
+		window, notebook, tab = results[0]
+
+		window.set_active_tab(tab)
+
+		return window
+
+
+	# spare window
+
+	# creating a window (and activating other plugins for it) is expensive,
+	# so a hidden window is created when idle, to be used the next time a
+	# window is reopened or restored
+	#
+	# the spare window is removed from the app so that gedit does not open
+	# files in it, and it does not keep the app running after the last
+	# visible window is closed
+
+	def is_spare_window(self, window):
+		return self._is_creating_spare_window or window is self._spare_window
+
+	def schedule_spare_window(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if not self.prewarm_window:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Not prewarming windows"))
+
+			return
+
+		if self._spare_window or self._spare_window_id:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Already have or scheduled spare window"))
+
+			return
+
+		self._spare_window_id = GLib.idle_add(
+			self.idle_create_spare_window,
+			priority=GLib.PRIORITY_LOW
+		)
+
+	def idle_create_spare_window(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._spare_window_id = None
+
+		if not self._app.get_main_windows():
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("No main windows, not creating spare window"))
+
+			return False
+
+		self._is_creating_spare_window = True
+
+		try:
+			window = self._app.create_window()
+			self._spare_window = window
+			self._app.remove_window(window)
+
+		finally:
+			self._is_creating_spare_window = False
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Created spare window %s", window))
+
+		return False
+
+	def take_spare_window(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		window = self._spare_window
+
+		if not window:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("No spare window"))
+
+			return None
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Using spare window %s", window))
+
+		self._spare_window = None
+
+		# the app will emit window-added and the window will be set up as usual
+		self._app.add_window(window)
+
+		self.schedule_spare_window()
+
+		return window
+
+	def discard_spare_window(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		if self._spare_window_id:
+			GLib.source_remove(self._spare_window_id)
+			self._spare_window_id = None
+
+		if self._spare_window:
+			window = self._spare_window
+			self._spare_window = None
+			window.destroy()
+
+
+	# quitting
+
+	# while quitting, gedit closes every tab one by one; rescanning the window
+	# structure for each tab would be quadratic, so windows are only marked
+	# as stale and rescanned once, when idle or when quitting is cancelled
+
+	def is_quitting(self):
+		return self._is_quitting
+
+	def set_quitting(self, is_quitting):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("is_quitting=%s", is_quitting))
+
+		if is_quitting == self._is_quitting:
+			return
+
+		self._is_quitting = is_quitting
+
+		if not is_quitting:
+			self.update_stale_windows()
+
+	def mark_stale_window(self, window):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s", window))
+
+		self._stale_windows.add(window)
+
+		if not self._stale_windows_id:
+			self._stale_windows_id = GLib.idle_add(
+				self.idle_update_stale_windows,
+				priority=GLib.PRIORITY_LOW
+			)
+
+	def update_stale_windows(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.cancel_update_stale_windows()
+
+		stale_windows = self._stale_windows
+		self._stale_windows = set()
+
+		for window in stale_windows:
+			state = self.get_window_state(window)
+
+			if state:
+				state.update_structure(window)
+
+	def cancel_update_stale_windows(self):
+		if self._stale_windows_id:
+			GLib.source_remove(self._stale_windows_id)
+			self._stale_windows_id = None
+
+	def idle_update_stale_windows(self):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self._stale_windows_id = None
+
+		self.update_stale_windows()
+
+		return False
+
+
 	# signal handlers
 
+	def on_notify_prewarm_window(self, window_manager, pspec):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("prewarm-window=%s", self.prewarm_window))
+
+		if self.prewarm_window:
+			self.schedule_spare_window()
+		else:
+			self.discard_spare_window()
+
 	def on_window_tab_added(self, window, tab, state):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, tab))
 
 		self.track_tab(window, tab, state)
 
+		self._stale_windows.discard(window)
+
 		state.update_structure(window)
 
 		self.emit('tab-added', window, tab)
@@ -405,7 +780,10 @@ class ExMortisWindowManager(GObject.Object):
 
 		self.untrack_tab(window, tab, state)
 
-		state.update_structure(window)
+		if self._is_quitting:
+			self.mark_stale_window(window)
+		else:
+			state.update_structure(window)
 
 		self.emit('tab-removed', window, tab)
 
@@ -413,6 +791,8 @@ class ExMortisWindowManager(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s", window))
 
+		self._stale_windows.discard(window)
+
 		state.update_structure(window)
 
 		self.emit('tabs-reordered', window)
@@ -447,7 +827,16 @@ class ExMortisWindowManager(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, notebook))
 
-		self.track_paned(window, notebook.get_parent(), state, multi_notebook)
+		# the new notebook is in a new paned, together with the notebook
+		# that was in its place
+		paned = notebook.get_parent()
+
+		if isinstance(paned, Gtk.Paned):
+			for child in paned.get_children():
+				if child is not notebook and isinstance(child, Gtk.Notebook):
+					self.reindex_notebook(window, child, state, multi_notebook)
+
+		self.index_notebook(window, notebook, state, multi_notebook)
 
 		self.debounce(multi_notebook, self.debounce_save_notebook_widths, window, state)
 
@@ -455,7 +844,13 @@ class ExMortisWindowManager(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s", window, notebook))
 
-		# can't untrack_paned() since the notebook is already disconnected and the paned gone
+		self.unindex_notebook(window, notebook, state, multi_notebook)
+
+		if window in self._stale_windows:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Window is stale, not saving notebook widths"))
+
+			return
 
 		self.debounce(multi_notebook, self.debounce_save_notebook_widths, window, state)
 
@@ -522,6 +917,8 @@ class ExMortisWindowManager(GObject.Object):
 
 		state.save_uri(window, tab)
 
+		self.index_tab(window, tab)
+
 		self.emit('tab-updated', window, tab)
 
 
@@ -576,6 +973,8 @@ class ExMortisWindowManager(GObject.Object):
 
 		self.cancel_debounce(obj)
 
+		metrics.increment('debounce.scheduled')
+
 		self._debounce_ids[obj] = GLib.timeout_add(1000, fn, obj, *args)
 
 	def cancel_debounce(self, obj):
@@ -583,6 +982,8 @@ class ExMortisWindowManager(GObject.Object):
 			Gedit.debug_plugin_message(log.format("%s", obj))
 
 		if obj in self._debounce_ids:
+			metrics.increment('debounce.cancelled')
+
 			GLib.source_remove(self._debounce_ids[obj])
 			del self._debounce_ids[obj]
 
@@ -591,8 +992,60 @@ class ExMortisWindowManager(GObject.Object):
 			Gedit.debug_plugin_message(log.format("%s", obj))
 
 		if obj in self._debounce_ids:
+			metrics.increment('debounce.executed')
+
 			del self._debounce_ids[obj]
 
+	def on_debounce_target_destroyed(self, obj, debounce_id):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s", obj))
+
+		metrics.increment('debounce.destroyed')
+
+		GLib.source_remove(debounce_id)
+
+
+	# debug report
+
+	# live tracked objects per window, to check that nothing is left behind
+	# after tabs, notebooks or windows are closed
+	def get_debug_report(self):
+		report = {}
+
+		for window, (state, widgets) in self._windows.items():
+			report[debug_str(window)] = dict(
+				state.get_debug_report(),
+				debounces=sum(
+					1
+					for obj in [window] + list(widgets.values())
+					if obj in self._debounce_ids
+				),
+				indexed_tabs=sum(
+					1
+					for tabs in self._uri_index.values()
+					for tab_window in tabs.values()
+					if tab_window is window
+				),
+				paneds=sum(
+					1
+					for paned_window, notebooks in self._paned_notebooks.values()
+					if paned_window is window
+				),
+				is_stale=window in self._stale_windows
+			)
+
+		report['all'] = {
+			'windows': len(self._windows),
+			'notebooks': len(self._notebook_paneds),
+			'paneds': len(self._paned_notebooks),
+			'debounces': len(self._debounce_ids),
+			'uris': len(self._uri_index),
+			'tabs': len(self._tab_uris),
+			'handlers': handler_stats(self)
+		}
+
+		return report
+
 
 	# screen info
 
@@ -624,3 +1077,20 @@ class ExMortisWindowManager(GObject.Object):
 
 		return height
 
+
+
+# signal handlers, debounced / idle callbacks, and the other entry points
+# recorded in traces
+instrument_methods(
+	ExMortisWindowManager,
+	(
+		'on_',
+		'debounce_',
+		'idle_',
+		'track_window',
+		'untrack_window',
+		'set_quitting',
+		'import_window_state',
+		'export_window_state'
+	)
+)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+#
+# windowpatch.py
+# This file is part of Ex-Mortis, a plugin for gedit
+#
+# Copyright (C) 2017-2019, 2023-2024 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/gedit-ex-mortis
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see <https://www.gnu.org/licenses/>.
+
+
+import gi
+gi.require_version('Gedit', '3.0')
+gi.require_version('Gio', '2.0')
+gi.require_version('Gtk', '3.0')
+
+from gi.repository import Gedit, Gio, Gtk
+from .compat import get_tab_uri
+from .retaineddocuments import fill_tab
+from . import metrics
+from . import log
+
+
+# patch_window() applies the operations from diff_window_states() (in
+# windowdiff.py) to a window, in order
+#
+# the context holds what is known about the window while the operations are
+# applied: the notebooks of the window, in order, and its tabs by uri; these
+# are found in one pass over the window's documents when first needed, then
+# kept up to date as operations create notebooks and open or close tabs,
+# instead of being looked up again for each operation
+#
+# operations that only set panel sizes and notebook widths depend on the
+# window (and any new notebooks) having been allocated, so they are held back
+# and applied together in the next frame clock update after the window is
+# allocated, giving one layout pass for all of them instead of one each
+#
+# the number of size-allocate passes of the window, from patching until the
+# frame after the held back operations are applied, is recorded in the
+# window.size-allocates histogram
+
+LAYOUT_OPS = frozenset([
+	'set-side-panel-size',
+	'set-bottom-panel-size',
+	'set-notebook-width'
+])
+
+class ExMortisPatchContext(object):
+
+	def __init__(self, window, retained_documents=None):
+		self.window = window
+		self.retained_documents = retained_documents
+		self.layout_ops = []
+		self.is_allocated = window.get_mapped()
+		self.size_allocates = 0
+		self.size_allocate_id = None
+		self._notebooks = None
+		self._tabs = None
+
+	def scan(self):
+		notebooks = []
+		notebooks_set = set()
+		tabs = {}
+
+		for document in self.window.get_documents():
+			tab = Gedit.Tab.get_from_document(document)
+			notebook = tab.get_parent()
+
+			if notebook not in notebooks_set:
+				notebooks.append(notebook)
+				notebooks_set.add(notebook)
+
+			uri = get_tab_uri(tab)
+
+			if uri:
+				tabs.setdefault(uri, tab)
+
+		self._notebooks = notebooks
+		self._tabs = tabs
+
+	@property
+	def notebooks(self):
+		if self._notebooks is None:
+			self.scan()
+
+		return self._notebooks
+
+	def get_tab(self, uri):
+		if self._tabs is None:
+			self.scan()
+
+		tab = self._tabs.get(uri)
+
+		# tabs that are still loading may not have their location yet
+		if not tab or not tab.get_parent():
+			tab = self.window.get_tab_from_location(Gio.File.new_for_uri(uri))
+
+			if tab:
+				self._tabs[uri] = tab
+
+		return tab
+
+	def add_tabs(self, tabs):
+		if self._tabs is None:
+			self.scan()
+			return
+
+		notebooks = self._notebooks
+
+		for tab in tabs:
+			uri = get_tab_uri(tab)
+
+			if uri:
+				self._tabs[uri] = tab
+
+			# an empty window gains its first notebook
+			if not notebooks:
+				notebooks.append(tab.get_parent())
+
+	def remove_tab(self, uri, tab, notebook):
+		self._tabs.pop(uri, None)
+
+		# gedit removes a notebook when its last tab is closed,
+		# unless it is the only notebook
+		if notebook.get_n_pages() == 0 and len(self._notebooks) > 1 and notebook in self._notebooks:
+			self._notebooks.remove(notebook)
+
+
+def patch_window(window, ops, retained_documents=None):
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("%s, %s ops", window, len(ops)))
+
+	context = ExMortisPatchContext(window, retained_documents)
+	context.size_allocate_id = window.connect('size-allocate', on_patch_window_size_allocate, context)
+
+	for op in ops:
+		name = op[0]
+
+		if name in LAYOUT_OPS:
+			context.layout_ops.append(op)
+			continue
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("Applying %s", op))
+
+		OPS[name](window, context, *op[1:])
+
+	window.add_tick_callback(on_patch_window_tick, context)
+
+def on_patch_window_size_allocate(window, allocation, context):
+	context.is_allocated = True
+	context.size_allocates += 1
+
+def on_patch_window_tick(window, frame_clock, context):
+	# new window, not allocated yet
+	if not context.is_allocated:
+		return True
+
+	layout_ops = context.layout_ops
+
+	if layout_ops is not None:
+		context.layout_ops = None
+
+		for op in layout_ops:
+			if log.query(log.DEBUG):
+				Gedit.debug_plugin_message(log.format("Applying %s", op))
+
+			OPS[op[0]](window, context, *op[1:])
+
+		# measure until these have been laid out
+		return True
+
+	window.disconnect(context.size_allocate_id)
+
+	if log.query(log.DEBUG):
+		Gedit.debug_plugin_message(log.format("%s size-allocate passes for %s", context.size_allocates, window))
+
+	metrics.observe('window.size-allocates', context.size_allocates)
+
+	return False
+
+def apply_geometry(window, context, width, height, maximized, fullscreen, is_default_size):
+	# need to unmaximize/unfullscreen to set size
+	# (for a new window, this is before it is shown, so these only set its
+	# initial state)
+	window.unmaximize()
+	window.unfullscreen()
+
+	if is_default_size:
+		window.set_default_size(width, height)
+	else:
+		window.resize(width, height)
+
+	if maximized:
+		window.maximize()
+
+	if fullscreen:
+		window.fullscreen()
+
+def apply_side_panel_page_name(window, context, page_name):
+	side_panel = window.get_side_panel()
+
+	try:
+		side_panel.set_active_item_name(page_name)
+	except AttributeError: # gedit 45
+		side_panel.set_visible_child_name(page_name)
+
+def apply_side_panel_visible(window, context, visible):
+	side_panel = window.get_template_child(Gedit.Window, 'side_panel')
+	side_panel.set_visible(visible)
+
+def apply_bottom_panel_page_name(window, context, page_name):
+	bottom_panel = window.get_bottom_panel()
+
+	try:
+		bottom_panel.set_active_item_name(page_name)
+	except AttributeError: # gedit 47
+		bottom_panel.set_visible_child_name(page_name)
+
+def apply_bottom_panel_visible(window, context, visible):
+	bottom_panel = window.get_template_child(Gedit.Window, 'bottom_panel')
+	bottom_panel.set_visible(visible)
+
+def apply_show(window, context):
+	window.show()
+
+def apply_side_panel_size(window, context, size):
+	hpaned = window.get_template_child(Gedit.Window, 'hpaned')
+	hpaned.set_position(size)
+
+def apply_bottom_panel_size(window, context, size):
+	vpaned = window.get_template_child(Gedit.Window, 'vpaned')
+	height = vpaned.get_allocation().height
+	position = max(height - size, 50)
+	vpaned.set_position(position)
+
+def apply_close_tab(window, context, uri):
+	tab = context.get_tab(uri)
+
+	if not tab:
+		return
+
+	if tab.get_document().get_modified():
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Not closing modified document %s", uri))
+
+		return
+
+	notebook = tab.get_parent()
+
+	window.close_tab(tab)
+
+	context.remove_tab(uri, tab, notebook)
+
+def apply_new_notebook(window, context):
+	notebooks = context.notebooks
+
+	# new tab groups are added after the active one
+	if notebooks:
+		last_notebook = notebooks[-1]
+		window.set_active_tab(last_notebook.get_nth_page(last_notebook.get_n_pages() - 1))
+
+	window.activate_action('new-tab-group')
+
+	notebooks.append(window.get_active_tab().get_parent())
+
+def apply_open_uris(window, context, notebook_index, uris):
+	notebooks = context.notebooks
+
+	if notebooks:
+		notebook = notebooks[notebook_index]
+		window.set_active_tab(notebook.get_nth_page(notebook.get_n_pages() - 1))
+
+	context.add_tabs(load_uris(window, uris, context.retained_documents))
+
+def apply_move_tab(window, context, notebook_index, uri, anchor_uri, is_after):
+	tab = context.get_tab(uri)
+	anchor = context.get_tab(anchor_uri)
+
+	if not tab or not anchor:
+		return
+
+	notebook = tab.get_parent()
+
+	if anchor.get_parent() is not notebook:
+		return
+
+	notebook.reorder_child(tab, -1)
+	position = notebook.page_num(anchor)
+	notebook.reorder_child(tab, position + 1 if is_after else position)
+
+def apply_active_uri(window, context, uri):
+	tab = context.get_tab(uri)
+
+	if not tab:
+		if log.query(log.WARNING):
+			Gedit.debug_plugin_message(log.format("Could not find tab for active uri"))
+
+		return
+
+	window.set_active_tab(tab)
+
+def apply_notebook_width(window, context, notebook_index, width):
+	notebooks = context.notebooks
+
+	try:
+		notebook = notebooks[notebook_index]
+	except IndexError:
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("Have %s notebooks, no notebook %s", len(notebooks), notebook_index))
+
+		return
+
+	parent = notebook.get_parent()
+
+	if not isinstance(parent, Gtk.Paned):
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("Parent %s of %s is not a Gtk.Paned", parent, notebook))
+
+		return
+
+	if parent.get_child2() is notebook:
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("%s is not the left child of parent %s", notebook, parent))
+
+		return
+
+	parent.set_position(width)
+
+OPS = {
+	'set-geometry': apply_geometry,
+	'set-side-panel-page-name': apply_side_panel_page_name,
+	'set-side-panel-visible': apply_side_panel_visible,
+	'set-bottom-panel-page-name': apply_bottom_panel_page_name,
+	'set-bottom-panel-visible': apply_bottom_panel_visible,
+	'show': apply_show,
+	'set-side-panel-size': apply_side_panel_size,
+	'set-bottom-panel-size': apply_bottom_panel_size,
+	'close-tab': apply_close_tab,
+	'new-notebook': apply_new_notebook,
+	'open-uris': apply_open_uris,
+	'move-tab': apply_move_tab,
+	'set-active-uri': apply_active_uri,
+	'set-notebook-width': apply_notebook_width
+}
+
+
+# helpers
+
+# returns the tabs that were opened
+def load_uris(window, uris, retained_documents=None):
+	locations = []
+	tabs = []
+
+	for uri in uris:
+		retained = retained_documents.take(uri) if retained_documents else None
+
+		if not retained:
+			locations.append(Gio.File.new_for_uri(uri))
+			continue
+
+		if log.query(log.INFO):
+			Gedit.debug_plugin_message(log.format("Using retained document for %s", uri))
+
+		# keep tab order
+		if locations:
+			tabs.extend(load_locations(window, locations))
+			locations = []
+
+		text, language, cursor_offset = retained
+		tab = window.create_tab(True)
+		fill_tab(tab, uri, text, language, cursor_offset)
+		tabs.append(tab)
+
+	if locations:
+		tabs.extend(load_locations(window, locations))
+
+	return tabs
+
+def load_locations(window, locations):
+	documents = Gedit.commands_load_locations(window, locations, None, 0, 0)
+
+	return [Gedit.Tab.get_from_document(document) for document in documents or []]
@@ -23,10 +23,13 @@ import gi
 gi.require_version('GObject', '2.0')
 gi.require_version('Gdk', '3.0')
 gi.require_version('Gedit', '3.0')
-gi.require_version('Gio', '2.0')
-gi.require_version('Gtk', '3.0')
 
-from gi.repository import GObject, Gdk, Gedit, Gio, Gtk
+from gi.repository import GObject, Gdk, Gedit
+from .compat import get_tab_uri, list_properties
+from .weakobjectmap import WeakObjectMap
+from .windowdiff import diff_window_states
+from .windowpatch import patch_window
+from . import metrics
 from . import log
 
 
@@ -60,14 +63,23 @@ class ExMortisWindowState(GObject.Object):
 	def __init__(self):
 		GObject.Object.__init__(self)
 
-		self._notebook_map = {}
-		self._tab_map = {}
+		self._notebook_map = WeakObjectMap()
+		self._tab_map = WeakObjectMap()
 		self._restore_filter = []
 		self._uris = []
 		self._restore_uris = []
 		self._notebook_widths = []
 		self._restore_notebook_widths = []
 		self._active_tab = None
+		# containers shared with a snapshot (or the source of a snapshot)
+		# must be copied before being modified in place
+		self._is_shared = False
+		# snapshots record uri changes and forgotten tabs here,
+		# and update restore uris / notebook widths only when needed
+		self._is_snapshot = False
+		self._uri_changes = {}
+		self._forgotten_tabs = WeakObjectMap()
+		self._is_restore_dirty = False
 
 
 	# class methods
@@ -76,16 +88,13 @@ class ExMortisWindowState(GObject.Object):
 	def clone(cls, source):
 		clone = cls()
 
-		try:
-			params = cls.list_properties()
-		except AttributeError: # gedit 3.12
-			params = GObject.list_properties(cls)
+		params = list_properties(cls)
 
 		for param in params:
 			clone.set_property(param.name, source.get_property(param.name))
 
-		clone._notebook_map = dict(source._notebook_map)
-		clone._tab_map = dict(source._tab_map)
+		clone._notebook_map = source._notebook_map.copy()
+		clone._tab_map = source._tab_map.copy()
 		clone._active_tab = source._active_tab
 
 		clone.uris = source.uris
@@ -93,24 +102,95 @@ class ExMortisWindowState(GObject.Object):
 
 		return clone
 
+	# takes constant time, as the snapshot shares its containers with source
+	# (properties are copied, but there are a fixed number of them)
+	@classmethod
+	def snapshot(cls, source):
+		metrics.increment('state.snapshot')
+
+		snapshot = cls()
+
+		params = list_properties(cls)
+
+		for param in params:
+			snapshot.set_property(param.name, source.get_property(param.name))
+
+		source.apply_uri_changes()
+
+		snapshot._notebook_map = source._notebook_map
+		snapshot._tab_map = source._tab_map
+		snapshot._restore_filter = source._restore_filter
+		snapshot._uris = source._uris
+		snapshot._restore_uris = source._restore_uris
+		snapshot._notebook_widths = source._notebook_widths
+		snapshot._restore_notebook_widths = source._restore_notebook_widths
+		snapshot._active_tab = source._active_tab
+		snapshot._is_restore_dirty = source._is_restore_dirty
+		snapshot._forgotten_tabs = source._forgotten_tabs.copy()
+
+		snapshot._is_shared = True
+		snapshot._is_snapshot = True
+		source._is_shared = True
+
+		return snapshot
+
+	@classmethod
+	def from_dict(cls, data):
+		state = cls()
+
+		params = list_properties(cls)
+
+		for param in params:
+			if param.name in data:
+				state.set_property(param.name, data[param.name])
+
+		state.uris = data.get('uris', [])
+		state.notebook_widths = data.get('notebook-widths', [])
+
+		return state
+
+
+	# serialization
+
+	def to_dict(self):
+		params = list_properties(self)
+
+		data = {
+			param.name : self.get_property(param.name)
+			for param in params
+		}
+
+		data['uris'] = self.restore_uris
+		data['notebook-widths'] = self.restore_notebook_widths
+
+		return data
+
 
 	# properties
 
 	@property
 	def uris(self):
+		self.apply_uri_changes()
+
 		return copy_uris(self._uris)
 
 	@uris.setter
 	def uris(self, value):
 		uris = copy_uris(value)
 
+		self.apply_uri_changes()
+
 		if uris != self._uris:
+			self.unshare()
+
 			self._uris = uris
 
 			self.emit('uris-changed')
 
 	@property
 	def restore_uris(self):
+		self.update_restore_data()
+
 		return copy_uris(self._restore_uris)
 
 	@property
@@ -122,12 +202,16 @@ class ExMortisWindowState(GObject.Object):
 		notebook_widths = list(value)
 
 		if notebook_widths != self._notebook_widths:
+			self.unshare()
+
 			self._notebook_widths = notebook_widths
 
 			self.emit('notebook-widths-changed')
 
 	@property
 	def restore_notebook_widths(self):
+		self.update_restore_data()
+
 		return list(self._restore_notebook_widths)
 
 
@@ -138,6 +222,10 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
+		if self._is_snapshot:
+			self._is_restore_dirty = True
+			return
+
 		filtered = [[uri for uri in uris if uri] for uris in self._uris]
 
 		self._restore_uris = [uris for uris in filtered if uris]
@@ -154,9 +242,82 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
+		if self._is_snapshot:
+			self._is_restore_dirty = True
+			return
+
+		zipped = zip(self._restore_filter, self._notebook_widths)
+		self._restore_notebook_widths = [width for can_restore, width in zipped if can_restore]
+
+
+	# snapshots
+
+	def unshare(self):
+		if not self._is_shared:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		metrics.increment('state.unshare')
+
+		self._notebook_map = self._notebook_map.copy()
+		self._tab_map = self._tab_map.copy()
+		self._uris = copy_uris(self._uris)
+		self._notebook_widths = list(self._notebook_widths)
+		self._is_shared = False
+
+	def apply_uri_changes(self):
+		if not self._uri_changes:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format("Applying %s uri changes", len(self._uri_changes)))
+
+		self.unshare()
+
+		uris = self._uris
+
+		for (notebook_index, tab_index), uri in self._uri_changes.items():
+			uris[notebook_index][tab_index] = uri
+
+		self._uri_changes = {}
+
+	def update_restore_data(self):
+		if not self._is_restore_dirty:
+			return
+
+		if log.query(log.DEBUG):
+			Gedit.debug_plugin_message(log.format(""))
+
+		self.apply_uri_changes()
+
+		filtered = [[uri for uri in uris if uri] for uris in self._uris]
+
+		self._restore_uris = [uris for uris in filtered if uris]
+		self._restore_filter = [bool(uris) for uris in filtered]
+
 		zipped = zip(self._restore_filter, self._notebook_widths)
 		self._restore_notebook_widths = [width for can_restore, width in zipped if can_restore]
 
+		self._is_restore_dirty = False
+
+	def get_tab_index(self, tab):
+		if tab in self._forgotten_tabs:
+			return None
+
+		return self._tab_map.get(tab)
+
+	def get_debug_report(self):
+		return {
+			'tabs': len(self._tab_map),
+			'forgotten_tabs': len(self._forgotten_tabs),
+			'notebooks': len(self._notebook_map),
+			'uri_changes': len(self._uri_changes),
+			'is_shared': self._is_shared,
+			'is_snapshot': self._is_snapshot
+		}
+
 
 	# saving / applying windows
 
@@ -179,32 +340,22 @@ class ExMortisWindowState(GObject.Object):
 		self.save_side_panel_size(window)
 		self.save_bottom_panel_size(window)
 
-	def apply_window(self, window, is_new_window=False):
+	# if current is the state of the window, only the differences are applied
+	def apply_window(self, window, is_new_window=False, retained_documents=None, current=None, skip_uris=None):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, is_new_window=%s", window, is_new_window))
 
-		# need to unmaximize/unfullscreen to set size
-		window.unmaximize()
-		window.unfullscreen()
-
-		self.apply_size(window, is_new_window)
-		self.apply_window_state(window)
+		start_time = metrics.now()
 
-		self.apply_side_panel_page_name(window)
-		self.apply_side_panel_visible(window)
-		self.apply_bottom_panel_page_name(window)
-		self.apply_bottom_panel_visible(window)
+		ops = diff_window_states(current, self, is_new_window, skip_uris=skip_uris)
 
-		if is_new_window:
-			window.show()
+		metrics.observe_elapsed('window.plan', start_time)
+		start_time = metrics.now()
 
-		self.apply_side_panel_size(window)
-		self.apply_bottom_panel_size(window)
+		patch_window(window, ops, retained_documents)
 
-		self.apply_uris(window)
-		self.apply_active_uri(window)
-
-		self.apply_notebook_widths(window)
+		metrics.observe_elapsed('window.patch', start_time)
+		metrics.increment('window.patch-ops', len(ops))
 
 
 	# property helpers
@@ -235,11 +386,13 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s", window))
 
+		metrics.increment('state.update-structure')
+
 		prev_uris = self._uris
 		prev_notebook_widths = self._notebook_widths
 
-		notebook_map = {}
-		tab_map = {}
+		notebook_map = WeakObjectMap()
+		tab_map = WeakObjectMap()
 		uris = []
 		notebook_widths = []
 
@@ -260,10 +413,15 @@ class ExMortisWindowState(GObject.Object):
 
 			tab_map[tab] = (notebook_index, tab_index)
 
+		self.release_maps()
+
 		self._notebook_map = notebook_map
 		self._tab_map = tab_map
 		self._uris = uris
 		self._notebook_widths = notebook_widths
+		self._is_shared = False
+		self._uri_changes = {}
+		self._forgotten_tabs = WeakObjectMap()
 
 		self.save_uris(window, bulk_update=True)
 		self.save_notebook_widths(window, bulk_update=True)
@@ -295,22 +453,41 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
-		self._notebook_map = {}
+		if not self._is_shared:
+			self._notebook_map.clear()
+
+		self._notebook_map = WeakObjectMap()
 
 	def forget_notebook(self, notebook):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s", notebook))
 
 		if notebook in self._notebook_map:
+			self.unshare()
+
 			del self._notebook_map[notebook]
 
 	def forget_tabs(self):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format(""))
 
-		self._tab_map = {}
+		if not self._is_shared:
+			self._tab_map.clear()
+
+		self._forgotten_tabs.clear()
+
+		self._tab_map = WeakObjectMap()
+		self._forgotten_tabs = WeakObjectMap()
 		self._active_tab = None
 
+	# maps shared with a snapshot (or its source) are left to the other state
+	def release_maps(self):
+		if not self._is_shared:
+			self._notebook_map.clear()
+			self._tab_map.clear()
+
+		self._forgotten_tabs.clear()
+
 	def forget_tab(self, tab):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s", tab))
@@ -318,7 +495,13 @@ class ExMortisWindowState(GObject.Object):
 		if tab is self._active_tab:
 			self._active_tab = None
 
-		if tab in self._tab_map:
+		if tab not in self._tab_map:
+			return
+
+		# avoid copying the tab map of a snapshot for each closed tab
+		if self._is_shared:
+			self._forgotten_tabs[tab] = True
+		else:
 			del self._tab_map[tab]
 
 
@@ -328,7 +511,11 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, bulk_update=%s", window, bulk_update))
 
-		results = [self.save_uri(window, tab, bulk_update=True) for tab in self._tab_map.keys()]
+		results = [
+			self.save_uri(window, tab, bulk_update=True)
+			for tab in self._tab_map.keys()
+			if tab not in self._forgotten_tabs
+		]
 		changed = any(results)
 
 		if not bulk_update and changed:
@@ -340,18 +527,25 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s, bulk_update=%s", window, tab, bulk_update))
 
+		metrics.increment('state.save-uri')
+
 		if not bulk_update and tab is self._active_tab:
 			self.save_active_uri(window)
 
-		if tab not in self._tab_map:
+		tab_index = self.get_tab_index(tab)
+
+		if tab_index is None:
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Tab map does not contain %s", tab))
 
 			return False
 
-		notebook_index, tab_index = self._tab_map[tab]
+		notebook_index, tab_index = tab_index
 
-		prev_uri = self._uris[notebook_index][tab_index]
+		prev_uri = self._uri_changes.get(
+			(notebook_index, tab_index),
+			self._uris[notebook_index][tab_index]
+		)
 
 		uri = get_tab_uri(tab)
 
@@ -367,42 +561,20 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("Previous uri=%s", prev_uri))
 
-		self._uris[notebook_index][tab_index] = uri
+		if self._is_snapshot:
+			# record as a change instead of copying the snapshot's uris
+			self._uri_changes[(notebook_index, tab_index)] = uri
+
+		else:
+			self.unshare()
+
+			self._uris[notebook_index][tab_index] = uri
 
 		if not bulk_update:
 			self.emit('uris-changed')
 
 		return True
 
-	def apply_uris(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		uris = self._restore_uris
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying uris=%s", uris))
-
-		if uris:
-			documents = window.get_documents()
-			create_notebook = False
-
-			if documents:
-				window.set_active_tab(Gedit.Tab.get_from_document(documents[-1]))
-
-			for notebook_uris in uris:
-				if create_notebook:
-					window.activate_action('new-tab-group')
-
-				locations = [
-					Gio.File.new_for_uri(uri)
-					for uri in notebook_uris
-				]
-
-				Gedit.commands_load_locations(window, locations, None, 0, 0)
-
-				create_notebook = True
-
 
 	# window notebook widths
 
@@ -422,6 +594,8 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("%s, %s, bulk_update=%s", window, notebook, bulk_update))
 
+		metrics.increment('state.save-notebook-width')
+
 		if notebook not in self._notebook_map:
 			if log.query(log.WARNING):
 				Gedit.debug_plugin_message(log.format("Notebook map does not contain %s", notebook))
@@ -446,6 +620,8 @@ class ExMortisWindowState(GObject.Object):
 		if log.query(log.DEBUG):
 			Gedit.debug_plugin_message(log.format("Previous notebook_width=%s", prev_notebook_width))
 
+		self.unshare()
+
 		self._notebook_widths[notebook_index] = notebook_width
 
 		if not bulk_update:
@@ -453,58 +629,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return True
 
-	def apply_notebook_widths(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		# this only works with the notebook structure created by apply_uris()
-
-		notebook_widths = list(self._notebook_widths)
-		notebooks = []
-		notebooks_set = set()
-
-		if len(notebook_widths) < 2:
-			if log.query(log.DEBUG):
-				Gedit.debug_plugin_message(log.format("Have %s notebook widths, not enough to apply", len(notebook_widths)))
-
-			return
-
-		for document in window.get_documents():
-			notebook = Gedit.Tab.get_from_document(document).get_parent()
-
-			if notebook not in notebooks_set:
-				notebooks.append(notebook)
-				notebooks_set.add(notebook)
-
-		if len(notebooks) < 2:
-			if log.query(log.DEBUG):
-				Gedit.debug_plugin_message(log.format("Have %s notebooks, not enough to apply", len(notebooks)))
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying notebook_widths=%s", notebook_widths))
-
-		min_len = min(len(notebooks), len(notebook_widths))
-
-		# we won't set the width of the last notebook
-		zipped = zip(notebooks[-min_len:-1], notebook_widths[-min_len:-1])
-
-		for notebook, notebook_width in zipped:
-			parent = notebook.get_parent()
-
-			if not isinstance(parent, Gtk.Paned):
-				if log.query(log.DEBUG):
-					Gedit.debug_plugin_message(log.format("Parent %s of %s is not a Gtk.Paned", parent, notebook))
-
-				continue
-
-			if parent.get_child2() is notebook:
-				if log.query(log.DEBUG):
-					Gedit.debug_plugin_message(log.format("%s is not the left child of parent %s", notebook, parent))
-
-				continue
-
-			parent.set_position(notebook_width)
-
 
 	# window active uri
 
@@ -527,32 +651,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('active-uri', active_uri)
 
-	def apply_active_uri(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		active_uri = self.active_uri
-
-		if not active_uri:
-			if log.query(log.DEBUG):
-				Gedit.debug_plugin_message(log.format("No active uri"))
-
-			return
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying active_uri=%s", active_uri))
-
-		location = Gio.File.new_for_uri(active_uri)
-		tab = window.get_tab_from_location(location)
-
-		if not tab:
-			if log.query(log.WARNING):
-				Gedit.debug_plugin_message(log.format("Could not find tab for active uri"))
-
-			return
-
-		window.set_active_tab(tab)
-
 
 	# window size
 
@@ -602,21 +700,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return any(results)
 
-	def apply_size(self, window, set_default_size=False):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s, set_default_size=%s", window, set_default_size))
-
-		width = self.width
-		height = self.height
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying width=%s, height=%s", width, height))
-
-		if set_default_size:
-			window.set_default_size(width, height)
-		else:
-			window.resize(width, height)
-
 
 	# window state (maximized / fullscreen)
 
@@ -645,26 +728,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return any(results)
 
-	def apply_window_state(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		maximized = self.maximized
-		fullscreen = self.fullscreen
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying maximized=%s, fullscreen=%s", maximized, fullscreen))
-
-		if maximized:
-			window.maximize()
-		else:
-			window.unmaximize()
-
-		if fullscreen:
-			window.fullscreen()
-		else:
-			window.unfullscreen()
-
 
 	# side panel page name
 
@@ -684,27 +747,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('side-panel-page-name', page_name)
 
-	def apply_side_panel_page_name(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		page_name = self.side_panel_page_name
-
-		if not page_name:
-			if log.query(log.WARNING):
-				Gedit.debug_plugin_message(log.format("No page name"))
-
-			return
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying page_name=%s", page_name))
-
-		side_panel = window.get_side_panel()
-		try:
-			side_panel.set_active_item_name(page_name)
-		except AttributeError: # gedit 45
-			side_panel.set_visible_child_name(page_name)
-
 
 	# side panel size
 
@@ -717,18 +759,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('side-panel-size', position)
 
-	def apply_side_panel_size(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		size = self.side_panel_size
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying size=%s", size))
-
-		hpaned = window.get_template_child(Gedit.Window, 'hpaned')
-		hpaned.set_position(size)
-
 
 	# side panel visible
 
@@ -741,18 +771,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('side-panel-visible', visible)
 
-	def apply_side_panel_visible(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		visible = self.side_panel_visible
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying visible=%s", visible))
-
-		side_panel = window.get_template_child(Gedit.Window, 'side_panel')
-		side_panel.set_visible(visible)
-
 
 	# bottom panel page name
 
@@ -772,28 +790,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('bottom-panel-page-name', page_name)
 
-	def apply_bottom_panel_page_name(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		page_name = self.bottom_panel_page_name
-
-		if not page_name:
-			# it is possible there are no bottom panel pages
-			if log.query(log.DEBUG):
-				Gedit.debug_plugin_message(log.format("No page name"))
-
-			return
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying page_name=%s", page_name))
-
-		bottom_panel = window.get_bottom_panel()
-		try:
-			bottom_panel.set_active_item_name(page_name)
-		except AttributeError: # gedit 47
-			bottom_panel.set_visible_child_name(page_name)
-
 
 	# bottom panel size
 
@@ -808,20 +804,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('bottom-panel-size', size)
 
-	def apply_bottom_panel_size(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		size = self.bottom_panel_size
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying size=%s", size))
-
-		vpaned = window.get_template_child(Gedit.Window, 'vpaned')
-		height = vpaned.get_allocation().height
-		position = max(height - size, 50)
-		vpaned.set_position(position)
-
 
 	# bottom panel visible
 
@@ -834,27 +816,6 @@ class ExMortisWindowState(GObject.Object):
 
 		return self.save_property('bottom-panel-visible', visible)
 
-	def apply_bottom_panel_visible(self, window):
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("%s", window))
-
-		visible = self.bottom_panel_visible
-
-		if log.query(log.DEBUG):
-			Gedit.debug_plugin_message(log.format("Applying visible=%s", visible))
-
-		bottom_panel = window.get_template_child(Gedit.Window, 'bottom_panel')
-		bottom_panel.set_visible(visible)
-
 
 def copy_uris(source):
 	return [[uri for uri in uris] for uris in source]
-
-def get_tab_uri(tab):
-	document = tab.get_document()
-	try:
-		location = document.get_file().get_location()
-	except AttributeError: # gedit 3.12
-		location = document.get_location()
-	return location.get_uri() if location else ''
-